@@ -0,0 +1,71 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare cache backends on open latency and lookup throughput.
+
+Usage: python benchmarks/cache_backends.py [ENTRIES]
+"""
+
+from gitbark.cache import CACHE_BACKENDS
+
+from types import SimpleNamespace
+import tempfile
+import random
+import time
+import sys
+import os
+
+OPENS = 200
+LOOKUPS = 100_000
+
+
+def bench(backend, entries: int, directory: str) -> tuple[float, float]:
+    path = os.path.join(directory, f"bench{backend.extension}")
+    hashes = [os.urandom(20) for _ in range(entries)]
+    cache = backend(path)
+    cache.set_many((h, True) for h in hashes)
+    cache.compact()
+    cache.close()
+
+    start = time.perf_counter()
+    for _ in range(OPENS):
+        backend(path).close()
+    open_latency = (time.perf_counter() - start) / OPENS
+
+    # Half hits, half misses
+    commits = [
+        SimpleNamespace(hash=random.choice(hashes) if i % 2 else os.urandom(20))
+        for i in range(LOOKUPS)
+    ]
+    cache = backend(path)
+    start = time.perf_counter()
+    for commit in commits:
+        cache.get(commit)
+    throughput = LOOKUPS / (time.perf_counter() - start)
+    cache.close()
+    return open_latency, throughput
+
+
+def main() -> None:
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"{entries} entries, {OPENS} opens, {LOOKUPS} lookups")
+    print(f"{'backend':10} {'open (ms)':>10} {'lookups/s':>12}")
+    for name, backend in CACHE_BACKENDS.items():
+        with tempfile.TemporaryDirectory() as directory:
+            open_latency, throughput = bench(backend, entries, directory)
+        print(f"{name:10} {open_latency * 1000:10.3f} {throughput:12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time a cherry-pick with hooks, with and without deferred steps.
+
+Usage: python benchmarks/sequencer.py [COMMITS]
+
+Run from the root of the repository, with bark installed.
+"""
+
+from gitbark.objects import BarkRules
+from gitbark.core import BARK_RULES_BRANCH
+from gitbark.git import Repository
+from gitbark.util import cmd
+
+from pytest_gitbark.util import write_bark_rules, on_branch
+
+import subprocess
+import tempfile
+import time
+import sys
+import os
+
+
+def setup(path: str, commits: int) -> Repository:
+    cmd("git", "init", "-b", "main", cwd=path)
+    cmd("git", "config", "commit.gpgsign", "false", cwd=path)
+    cmd("git", "config", "user.name", "Bench", cwd=path)
+    cmd("git", "config", "user.email", "bench@example.com", cwd=path)
+    cmd("git", "commit", "-m", "Initial commit", "--allow-empty", cwd=path)
+    repo = Repository(path)
+
+    ref_rule = {
+        "bootstrap": repo.head.hash.hex(),
+        "refs": [{"pattern": "refs/heads/main"}],
+    }
+    module = os.path.join(os.getcwd(), "tests", "test_bark_module")
+    with on_branch(repo, BARK_RULES_BRANCH, True):
+        write_bark_rules(repo, BarkRules([], project=[ref_rule]), module)
+        cmd("git", "commit", "-m", "Add bark rules", cwd=path)
+
+    with on_branch(repo, "feature"):
+        for i in range(commits):
+            cmd("git", "commit", "-m", f"Commit {i}", "--allow-empty", cwd=path)
+
+    subprocess.run(["bark", "install"], input=b"y\n", cwd=path, check=True)
+    return repo
+
+
+def timed(*args: str, cwd: str) -> float:
+    start = time.perf_counter()
+    cmd(*args, cwd=cwd)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    commits = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"{commits} commits")
+    print(f"{'defer':6} {'cherry-pick (s)':>16}")
+    with tempfile.TemporaryDirectory() as path:
+        repo = setup(path, commits)
+        base = repo.head.hash.hex()
+        for defer in ("true", "false"):
+            cmd("git", "config", "bark.deferSequencer", defer, cwd=path)
+            cmd("git", "reset", "--hard", base, cwd=path)
+            pick = timed(
+                "git", "cherry-pick", "--allow-empty", "main..feature", cwd=path
+            )
+            print(f"{defer:6} {pick:16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare peak memory of verifying a history, with and without streaming.
+
+Usage: python benchmarks/streaming.py [COMMITS...]
+
+Run from the root of the repository, with bark installed. Each verification
+runs in a separate process, and reports the peak RSS of that process only.
+"""
+
+from gitbark.objects import BarkRules
+from gitbark.core import BARK_RULES_BRANCH
+from gitbark.git import Repository
+from gitbark.util import cmd
+
+from pytest_gitbark.util import write_bark_rules, on_branch
+
+import subprocess
+import resource
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+
+def setup(path: str, commits: int) -> None:
+    cmd("git", "init", "-b", "main", cwd=path)
+    cmd("git", "config", "commit.gpgsign", "false", cwd=path)
+    cmd("git", "config", "user.name", "Bench", cwd=path)
+    cmd("git", "config", "user.email", "bench@example.com", cwd=path)
+    cmd("git", "commit", "-m", "Initial commit", "--allow-empty", cwd=path)
+    repo = Repository(path)
+
+    ref_rule = {
+        "bootstrap": repo.head.hash.hex(),
+        "refs": [{"pattern": "refs/heads/main"}],
+    }
+    module = os.path.join(os.getcwd(), "tests", "test_bark_module")
+    with on_branch(repo, BARK_RULES_BRANCH, True):
+        write_bark_rules(repo, BarkRules([], project=[ref_rule]), module)
+        cmd("git", "commit", "-m", "Add bark rules", cwd=path)
+
+    # Add empty commits to main, faster than committing one at a time
+    stream = "".join(
+        f"commit refs/heads/main\n"
+        f"committer Bench <bench@example.com> {1700000000 + i} +0000\n"
+        f"data <<EOF\nCommit {i}\nEOF\n"
+        + ("from refs/heads/main^0\n" if i == 0 else "")
+        + "\n"
+        for i in range(commits)
+    )
+    cmd("git", "fast-import", "--quiet", cwd=path, input=stream)
+
+    subprocess.run(["bark", "install"], input=b"y\n", cwd=path, check=True)
+
+
+def run(path: str, stream: bool) -> None:
+    """Verify all refs, then print the peak RSS in MiB and the time taken.
+
+    ru_maxrss is in KiB on Linux.
+    """
+    from gitbark.commands.verify import verify_all
+    from gitbark.project import Project
+
+    project = Project(path)
+    start = time.perf_counter()
+    verify_all(project, stream=stream)
+    elapsed = time.perf_counter() - start
+    project.update()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{peak:.1f} {elapsed:.2f}")
+
+
+def measure(path: str, stream: bool) -> tuple[float, float]:
+    # Start from an empty cache
+    bark_directory = os.path.join(path, ".git", "bark")
+    shutil.rmtree(os.path.join(bark_directory, "cache"))
+    os.mkdir(os.path.join(bark_directory, "cache"))
+    for f in ("checkpoints.json", "ref_snapshot.json"):
+        if os.path.exists(os.path.join(bark_directory, f)):
+            os.remove(os.path.join(bark_directory, f))
+    script = os.path.abspath(__file__)
+    output = cmd(sys.executable, script, "--run", path, str(stream), cwd=path)[0]
+    peak, elapsed = output.split()
+    return float(peak), float(elapsed)
+
+
+def main() -> None:
+    if sys.argv[1:2] == ["--run"]:
+        run(sys.argv[2], sys.argv[3] == "True")
+        return
+
+    sizes = [int(n) for n in sys.argv[1:]] or [10_000, 20_000, 40_000]
+    print(f"{'commits':>8} {'mode':8} {'peak RSS (MiB)':>15} {'time (s)':>9}")
+    for commits in sizes:
+        with tempfile.TemporaryDirectory() as path:
+            setup(path, commits)
+            for stream in (False, True):
+                peak, elapsed = measure(path, stream)
+                mode = "stream" if stream else "walk"
+                print(f"{commits:8} {mode:8} {peak:15.1f} {elapsed:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,10 +15,14 @@
 
 from .git import Commit
 
-from typing import Generator, Optional
+from abc import ABC, abstractmethod
+from typing import ClassVar, Generator, Iterable, Iterator, Optional
 import os
+import bisect
 import sqlite3
 import contextlib
+import fcntl
+import mmap
 
 
 @contextlib.contextmanager
@@ -33,7 +37,7 @@ def _create_db(db_path: str) -> None:
     with connect_db(db_path) as db:
         db.executescript(
             """
-            CREATE TABLE cache_entries (
+            CREATE TABLE IF NOT EXISTS cache_entries (
                 commit_hash TEXT NOT NULL,
                 valid INTEGER NOT NULL,
                 PRIMARY KEY (commit_hash) ON CONFLICT IGNORE
@@ -42,11 +46,114 @@ def _create_db(db_path: str) -> None:
         )
 
 
-class Cache:
-    def __init__(self, db_path: str) -> None:
-        if not os.path.exists(db_path):
-            _create_db(db_path)
-        self._db = sqlite3.connect(db_path)
+# Seconds to wait for another process writing to a SQLite cache
+BUSY_TIMEOUT = 30
+
+
+class Cache(ABC):
+    """Storage of commit validation results for a bootstrap.
+
+    Setting an entry for a commit which already has one is a no-op. To change
+    an entry it must first be removed.
+    """
+
+    extension: ClassVar[str]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @staticmethod
+    def files(path: str) -> list[str]:
+        """Get the files used to store a cache at path."""
+        return [path]
+
+    @property
+    def size(self) -> int:
+        """The size of the cache on disk, in bytes."""
+        return sum(
+            os.path.getsize(f) for f in self.files(self.path) if os.path.exists(f)
+        )
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.entries())
+
+    @abstractmethod
+    def get(self, commit: Commit) -> Optional[bool]:
+        """Get the validity of a commit, or None if not cached."""
+
+    def has(self, commit: Commit) -> bool:
+        return self.get(commit) is not None
+
+    @abstractmethod
+    def set(self, commit: Commit, valid: bool) -> None:
+        pass
+
+    @abstractmethod
+    def remove(self, commit: Commit) -> None:
+        pass
+
+    @abstractmethod
+    def entries(self, batch_size: int = 1000) -> Iterator[tuple[bytes, bool]]:
+        """Iterate over all (commit hash, valid) entries, ordered by hash.
+
+        Entries are read in batches of batch_size, so that iterating over
+        a large cache does not require holding it in memory.
+        """
+
+    @abstractmethod
+    def set_many(self, entries: Iterable[tuple[bytes, bool]]) -> None:
+        pass
+
+    @abstractmethod
+    def remove_many(self, hashes: Iterable[bytes]) -> None:
+        pass
+
+    def flush(self) -> None:
+        """Write pending changes, keeping the cache open."""
+
+    @abstractmethod
+    def compact(self) -> None:
+        """Write pending changes and reclaim unused space."""
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class SqliteCache(Cache):
+    """Cache stored in a SQLite database."""
+
+    extension = ".db"
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        if not os.path.exists(path):
+            _create_db(path)
+        # Callers sharing a cache between threads serialize access to it.
+        # Each write is committed right away, so that processes sharing the
+        # cache, e.g. from several worktrees, don't block each other.
+        self._db = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+
+    @staticmethod
+    def files(path: str) -> list[str]:
+        return [path, f"{path}-wal", f"{path}-shm"]
+
+    def _execute_many(self, sql: str, params: Iterable[list]) -> None:
+        """Execute a statement for many parameters, in one transaction."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.executemany(sql, params)
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
 
     def get(self, commit: Commit) -> Optional[bool]:
         entry = self._db.execute(
@@ -74,6 +181,207 @@ class Cache:
             [commit.hash.hex()],
         )
 
+    def entries(self, batch_size: int = 1000) -> Iterator[tuple[bytes, bool]]:
+        last = ""
+        while True:
+            rows = self._db.execute(
+                "SELECT commit_hash, valid FROM cache_entries "
+                "WHERE commit_hash > ? ORDER BY commit_hash LIMIT ?",
+                [last, batch_size],
+            ).fetchall()
+            for commit_hash, valid in rows:
+                yield bytes.fromhex(commit_hash), bool(valid)
+            if len(rows) < batch_size:
+                break
+            last = rows[-1][0]
+
+    def set_many(self, entries: Iterable[tuple[bytes, bool]]) -> None:
+        self._execute_many(
+            "INSERT INTO cache_entries (commit_hash, valid) " "VALUES (?, ?)",
+            ([h.hex(), int(valid)] for h, valid in entries),
+        )
+
+    def remove_many(self, hashes: Iterable[bytes]) -> None:
+        self._execute_many(
+            "DELETE FROM cache_entries WHERE commit_hash = ? ",
+            ([h.hex()] for h in hashes),
+        )
+
+    def compact(self) -> None:
+        self._db.execute("VACUUM")
+        self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
     def close(self) -> None:
-        self._db.commit()
         self._db.close()
+
+
+_OID_SIZE = 20
+_RECORD_SIZE = _OID_SIZE + 1
+_INVALID, _VALID, _REMOVED = b"\x00", b"\x01", b"\x02"
+
+
+class _Index:
+    """Sorted, fixed-size (commit hash, valid) records, searched through mmap."""
+
+    def __init__(self, path: str) -> None:
+        self._data: Optional[mmap.mmap] = None
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self._data) // _RECORD_SIZE if self._data else 0
+
+    def __getitem__(self, i: int) -> bytes:
+        assert self._data is not None
+        return self._data[i * _RECORD_SIZE : i * _RECORD_SIZE + _OID_SIZE]
+
+    def get(self, oid: bytes) -> Optional[bool]:
+        i = bisect.bisect_left(self, oid)  # type: ignore
+        if i < len(self) and self[i] == oid:
+            assert self._data is not None
+            return self._data[i * _RECORD_SIZE + _OID_SIZE] == _VALID[0]
+        return None
+
+    def __iter__(self) -> Iterator[tuple[bytes, bool]]:
+        if self._data:
+            for i in range(len(self)):
+                record = self._data[i * _RECORD_SIZE : (i + 1) * _RECORD_SIZE]
+                yield record[:_OID_SIZE], record[_OID_SIZE] == _VALID[0]
+
+    def close(self) -> None:
+        if self._data:
+            self._data.close()
+
+
+class LogCache(Cache):
+    """Cache stored as an append-only log and a sorted index.
+
+    Changes are appended to the log as fixed-size records, and are merged into
+    the index by compaction. The index is memory-mapped and binary searched, so
+    opening the cache only requires reading the log.
+    """
+
+    extension = ".log"
+    compact_threshold = 4096  # Number of log records
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self._index_path = self.files(path)[1]
+        self._fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        if not os.path.exists(self._index_path):
+            open(self._index_path, "ab").close()
+        self._load()
+
+    @staticmethod
+    def files(path: str) -> list[str]:
+        return [path, os.path.splitext(path)[0] + ".idx"]
+
+    def _load(self) -> None:
+        self._index = _Index(self._index_path)
+        self._log: dict[bytes, Optional[bool]] = {}
+        self._log_records = 0
+        with open(self.path, "rb") as f:
+            while record := f.read(_RECORD_SIZE):
+                if len(record) < _RECORD_SIZE:
+                    break  # Partially written record
+                state = record[_OID_SIZE : _OID_SIZE + 1]
+                self._log[record[:_OID_SIZE]] = (
+                    None if state == _REMOVED else state == _VALID
+                )
+                self._log_records += 1
+
+    def _append(self, records: Iterable[tuple[bytes, bytes]]) -> None:
+        data = bytearray()
+        for oid, state in records:
+            data += oid + state
+            self._log[oid] = None if state == _REMOVED else state == _VALID
+            self._log_records += 1
+        if data:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                os.write(self._fd, data)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _get(self, oid: bytes) -> Optional[bool]:
+        if oid in self._log:
+            return self._log[oid]
+        return self._index.get(oid)
+
+    def get(self, commit: Commit) -> Optional[bool]:
+        return self._get(commit.hash)
+
+    def set(self, commit: Commit, valid: bool) -> None:
+        self.set_many([(commit.hash, valid)])
+
+    def remove(self, commit: Commit) -> None:
+        self.remove_many([commit.hash])
+
+    def entries(self, batch_size: int = 1000) -> Iterator[tuple[bytes, bool]]:
+        log = sorted(self._log.items())
+        i = 0
+        for oid, valid in self._index:
+            while i < len(log) and log[i][0] < oid:
+                if log[i][1] is not None:
+                    yield log[i]  # type: ignore
+                i += 1
+            if i < len(log) and log[i][0] == oid:
+                if log[i][1] is not None:
+                    yield log[i]  # type: ignore
+                i += 1
+            else:
+                yield oid, valid
+        for entry in log[i:]:
+            if entry[1] is not None:
+                yield entry  # type: ignore
+
+    def set_many(self, entries: Iterable[tuple[bytes, bool]]) -> None:
+        self._append(
+            (oid, _VALID if valid else _INVALID)
+            for oid, valid in entries
+            if self._get(oid) is None
+        )
+
+    def remove_many(self, hashes: Iterable[bytes]) -> None:
+        self._append((oid, _REMOVED) for oid in hashes if self._get(oid) is not None)
+
+    def compact(self) -> None:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # Pick up records appended by other processes
+            self._index.close()
+            self._load()
+            with open(f"{self._index_path}.tmp", "wb") as f:
+                for oid, valid in self.entries():
+                    f.write(oid + (_VALID if valid else _INVALID))
+            os.replace(f"{self._index_path}.tmp", self._index_path)
+            os.truncate(self.path, 0)
+            self._index.close()
+            self._load()
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        if self._log_records > self.compact_threshold:
+            self.compact()
+        self._index.close()
+        os.close(self._fd)
+
+
+CACHE_BACKENDS: dict[str, type[Cache]] = {
+    "sqlite": SqliteCache,
+    "log": LogCache,
+}
+
+
+def get_backend(path: str) -> type[Cache]:
+    """Get the backend of a cache, given by the file extension."""
+    for backend in CACHE_BACKENDS.values():
+        if path.endswith(backend.extension):
+            return backend
+    raise ValueError(f"Unsupported cache: {path}")
+
+
+def open_cache(path: str) -> Cache:
+    return get_backend(path)(path)
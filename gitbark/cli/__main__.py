@@ -12,30 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from gitbark.commands.verify import (
-    verify_all,
-    verify_ref,
-    verify_commit,
-    verify_ref_update,
-)
-from gitbark.commands.install import install as install_cmd
-from gitbark.commands.setup import (
-    setup as setup_cmd,
-    add_modules_interactive,
-    add_branches_interactive,
-    add_commit_rules_interactive,
-    _confirm_commit,
-    checkout_or_orphan,
-)
-
 from gitbark.core import BARK_RULES_REF
-from gitbark.project import Project
+from gitbark.project import Project, FAIL_FAST_CONFIG
 from gitbark.rule import RuleViolation
 from gitbark.util import cmd
 from gitbark.git import Commit, BRANCH_REF_PREFIX, TAG_REF_PREFIX
 from gitbark.logging import init_logging, LOG_LEVEL
 from .util import (
     BarkContextObject,
+    LazyGroup,
     click_callback,
     CliFail,
     EnumChoice,
@@ -44,10 +29,10 @@ from .util import (
     _add_subcommands,
 )
 
+from typing import Optional
 import click
 import logging
 import sys
-import os
 
 logger = logging.getLogger(__name__)
 
@@ -81,7 +66,14 @@ def format_ref(ref: str) -> str:
     return ref
 
 
-@click.group()
+@click.group(
+    cls=LazyGroup,
+    lazy_subcommands={
+        "cache": "gitbark.cli.cache:cache",
+        "modules": "gitbark.cli.modules:modules",
+        "notes": "gitbark.cli.notes:notes",
+    },
+)
 @click.pass_context
 @click.option(
     "-l",
@@ -115,6 +107,7 @@ def cli(ctx, log_level, log_file):
 @click.pass_context
 def setup(ctx):
     """Setup GitBark in repo."""
+    from gitbark.commands.setup import setup as setup_cmd
 
     project = ctx.obj["project"]
     setup_cmd(project)
@@ -124,6 +117,8 @@ def setup(ctx):
 @click.pass_context
 def add_rules(ctx):
     """Add commit rules to a branch."""
+    from gitbark.commands.setup import add_commit_rules_interactive, _confirm_commit
+
     project = ctx.obj["project"]
     add_commit_rules_interactive(project)
     _confirm_commit(
@@ -140,6 +135,12 @@ def add_rules(ctx):
 @click.pass_context
 def add_modules(ctx):
     """Add bark modules."""
+    from gitbark.commands.setup import (
+        add_modules_interactive,
+        _confirm_commit,
+        checkout_or_orphan,
+    )
+
     project = ctx.obj["project"]
     branch = project.repo.branch
     add_modules_interactive(project)
@@ -162,6 +163,12 @@ def protect(ctx):
     so that when changes are made to this branch, they are validated
     automatically.
     """
+    from gitbark.commands.setup import (
+        add_branches_interactive,
+        _confirm_commit,
+        checkout_or_orphan,
+    )
+
     project = ctx.obj["project"]
     branch = project.repo.branch
     add_branches_interactive(project, branch)
@@ -177,13 +184,21 @@ def protect(ctx):
 
 @cli.command()
 @click.pass_context
-def install(ctx):
+@click.option(
+    "--pre-push",
+    is_flag=True,
+    default=False,
+    help="Also verify outgoing refs before pushing them.",
+)
+def install(ctx, pre_push):
     """
     Install hooks.
 
     Install GitBark in Git hooks, so that verification is performed automatically
     on repository changes.
     """
+    from gitbark.commands.install import install as install_cmd
+
     project = ctx.obj["project"]
 
     repo = project.repo
@@ -193,7 +208,7 @@ def install(ctx):
     ensure_bootstrap_verified(project)
 
     try:
-        install_cmd(project)
+        install_cmd(project, pre_push)
         logger.info("Hooks installed successfully")
     except RuleViolation as e:
         pp_violation(e)
@@ -210,34 +225,50 @@ def click_parse_bootstrap(ctx, param, val):
     return None
 
 
+def _read_ref_updates() -> list[tuple[str, str, str]]:
+    """Read ref updates from stdin, as 'OLD NEW REF' lines."""
+    updates = []
+    for line in sys.stdin:
+        if line.strip():
+            old, new, ref = line.split()
+            updates.append((old, new, ref))
+    return updates
+
+
 @cli.command(hidden=True)
 @click.pass_context
-@click.argument("old")
-@click.argument("new")
-@click.argument("ref")
-def ref_update(ctx, old, new, ref):
+@click.argument("old", required=False)
+@click.argument("new", required=False)
+@click.argument("ref", required=False)
+@click.option(
+    "--stdin",
+    is_flag=True,
+    default=False,
+    help="Read all updates of the transaction, as 'OLD NEW REF' lines.",
+)
+@click.option(
+    "--all-commits",
+    is_flag=True,
+    default=False,
+    help="Verify every commit between OLD and NEW, not only NEW.",
+)
+def ref_update(ctx, old, new, ref, stdin, all_commits):
     """Verify ref update"""
-    project = ctx.obj["project"]
-
-    if old == new or ref not in project.repo.references:
-        # Not a change of a "real" ref
-        return
+    from gitbark.commands.verify import verify_ref_transaction
+    from gitbark.commands.auto_gc import maybe_auto_gc
 
-    if new == "00" * 20:
-        # Ref deletion
-        return
+    if stdin:
+        updates = _read_ref_updates()
+    elif old and new and ref:
+        updates = [(old, new, ref)]
+    else:
+        raise CliFail("Either OLD NEW REF or --stdin is required")
 
-    head = Commit(bytes.fromhex(new), project.repo)
-    fail_head = os.path.join(project.bark_directory, "FAIL_HEAD")
+    project = ctx.obj["project"]
     try:
-        verify_ref_update(project, ref, head)
-        if os.path.exists(fail_head):
-            os.remove(fail_head)
-        # TODO: Need to enable logging through env variable
-        logger.info(f"{ref} is valid")
+        if verify_ref_transaction(project, updates, all_commits=all_commits):
+            maybe_auto_gc(project)
     except RuleViolation as e:
-        with open(fail_head, "w") as f:
-            f.write(head.hash.hex())
         # TODO: Error message here?
         pp_violation(e)
         sys.exit(1)
@@ -245,6 +276,50 @@ def ref_update(ctx, old, new, ref):
         project.update()
 
 
+def _report_rejected(results: dict[str, Optional[RuleViolation]]) -> None:
+    """Print the violations of rejected refs, and exit if there are any."""
+    rejected = {ref: v for ref, v in results.items() if v}
+    for ref, violation in rejected.items():
+        click.echo(f"{format_ref(ref)} was rejected:")
+        pp_violation(violation)
+    if rejected:
+        sys.exit(1)
+
+
+@cli.command(hidden=True)
+@click.pass_context
+def pre_receive(ctx):
+    """Verify the ref updates of a push, read from stdin"""
+    from gitbark.commands.verify import verify_received_refs
+
+    updates = _read_ref_updates()
+    project = ctx.obj["project"]
+    try:
+        results = verify_received_refs(project, updates)
+    finally:
+        project.update()
+    _report_rejected(results)
+
+
+@cli.command(hidden=True)
+@click.pass_context
+def pre_push(ctx):
+    """Verify the refs to push, read from stdin"""
+    from gitbark.commands.verify import verify_pushed_refs
+
+    updates = []
+    for line in sys.stdin:
+        if line.strip():
+            local_ref, local_hash, remote_ref, remote_hash = line.split()
+            updates.append((local_ref, local_hash, remote_ref, remote_hash))
+    project = ctx.obj["project"]
+    try:
+        results = verify_pushed_refs(project, updates)
+    finally:
+        project.update()
+    _report_rejected(results)
+
+
 @cli.command()
 @click.pass_context
 @click.argument("target", default="HEAD")
@@ -256,6 +331,27 @@ def ref_update(ctx, old, new, ref):
     default=False,
     help="Verify all refs.",
 )
+@click.option(
+    "-c",
+    "--changed",
+    is_flag=True,
+    default=False,
+    help="Verify all refs changed since they were last verified as valid.",
+)
+@click.option(
+    "-s",
+    "--stream",
+    is_flag=True,
+    default=False,
+    help="Validate commits using bounded memory, for very large histories.",
+)
+@click.option(
+    "-f",
+    "--fail-fast",
+    is_flag=True,
+    default=False,
+    help="Stop at the first invalid ref, when verifying all refs.",
+)
 @click.option(
     "-b",
     "--bootstrap",
@@ -263,24 +359,28 @@ def ref_update(ctx, old, new, ref):
     help="Verify from bootstrap",
     callback=click_parse_bootstrap,
 )
-def verify(ctx, target, all, bootstrap):
+def verify(ctx, target, all, changed, stream, fail_fast, bootstrap):
     """
     Verify repository or ref.
 
     \b
     TARGET the commit or ref to verify.
     """
+    from gitbark.commands.verify import verify_all, verify_ref, verify_commit
+    from gitbark.commands.auto_gc import maybe_auto_gc
+
     project = ctx.obj["project"]
     ensure_bootstrap_verified(project)
 
     try:
-        if all:
-            verify_all(project)
+        if all or changed:
+            fail_fast = fail_fast or project.repo.get_config_bool(FAIL_FAST_CONFIG)
+            verify_all(project, changed, stream, fail_fast)
             logger.info("All references are valid")
         else:
             head, ref = project.repo.resolve(target)
             if ref:
-                verify_ref(project, ref, head)
+                verify_ref(project, ref, head, stream=stream)
                 logger.info(f"{ref} is valid")
             elif not bootstrap:
                 raise CliFail(
@@ -289,6 +389,7 @@ def verify(ctx, target, all, bootstrap):
             else:
                 verify_commit(project, head, bootstrap)
                 logger.info(f"Commit {head.hash.hex()} is valid")
+        maybe_auto_gc(project)
     except RuleViolation as e:
         # TODO: Error message here?
         pp_violation(e)
@@ -297,6 +398,68 @@ def verify(ctx, target, all, bootstrap):
         project.update()
 
 
+@cli.command()
+@click.pass_context
+@click.option(
+    "--json",
+    "as_json",
+    is_flag=True,
+    default=False,
+    help="Output the status as JSON.",
+)
+def status(ctx, as_json):
+    """
+    Show whether refs with rules are known to be valid.
+
+    The status is read from the cache and the results of previous
+    verifications, without validating anything. A ref is unknown if its
+    current target has not been verified with its current rules.
+    """
+    from gitbark.commands.status import get_status
+    import json
+
+    project = ctx.obj["project"]
+    try:
+        ref_status = get_status(project)
+    finally:
+        project.update()
+
+    if as_json:
+        data = {
+            ref: {"target": head.hash.hex(), "status": status.value}
+            for ref, (head, status) in ref_status.items()
+        }
+        click.echo(json.dumps(data, indent=2))
+    else:
+        for ref, (head, status) in ref_status.items():
+            click.echo(f"{status.value:8} {head.hash.hex()[:12]} {format_ref(ref)}")
+
+
+@cli.command()
+@click.pass_context
+@click.option(
+    "--stop",
+    is_flag=True,
+    default=False,
+    help="Stop the running daemon.",
+)
+def daemon(ctx, stop):
+    """
+    Serve hook verifications from a long-lived process.
+
+    While the daemon is running, the reference-transaction hook sends ref
+    updates to it over a Unix socket, instead of starting bark for each update.
+    """
+    from gitbark.commands.daemon import Daemon, stop_daemon
+
+    project = ctx.obj["project"]
+    if stop:
+        stop_daemon(project)
+    else:
+        project.update()
+        Daemon(project.path).serve()
+
+
 class _DefaultFormatter(logging.Formatter):
     def __init__(self, show_trace=False):
         self.show_trace = show_trace
@@ -0,0 +1,108 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.commands.cache import (
+    gc as gc_cmd,
+    export_caches,
+    import_caches,
+    DEFAULT_GRACE_PERIOD,
+)
+
+import click
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@click.group()
+def cache():
+    """Manage the validation cache."""
+
+
+@cache.command()
+@click.pass_context
+@click.option(
+    "--grace-period",
+    type=click.IntRange(min=0),
+    default=DEFAULT_GRACE_PERIOD,
+    show_default=True,
+    metavar="DAYS",
+    help="Keep entries for unreachable commits younger than this.",
+)
+def gc(ctx, grace_period):
+    """
+    Remove stale cache entries.
+
+    Removes entries for commits no longer reachable from any ref, deletes caches
+    for bootstraps no longer listed in bark_rules, and compacts the remaining
+    caches.
+    """
+    project = ctx.obj["project"]
+    try:
+        result = gc_cmd(project, grace_period)
+    finally:
+        project.update()
+    logger.info(
+        f"Removed {result.entries_removed} entries and {result.caches_removed} "
+        f"caches, reclaiming {result.bytes_reclaimed} bytes"
+    )
+
+
+@cache.command("export")
+@click.pass_context
+@click.argument("file", type=click.Path(dir_okay=False))
+@click.option(
+    "--base",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Only export entries not already in this previous export.",
+)
+def export_cache(ctx, file, base):
+    """
+    Export the validation cache.
+
+    \b
+    FILE the file to write the export to.
+    """
+    project = ctx.obj["project"]
+    try:
+        count = export_caches(project, file, base)
+    finally:
+        project.update()
+    logger.info(f"Exported {count} entries to {file}")
+
+
+@cache.command("import")
+@click.pass_context
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Import even if the export was made using different bark modules.",
+)
+def import_cache(ctx, file, force):
+    """
+    Import a previously exported validation cache.
+
+    Imported entries are trusted as-is. Only import exports from a trusted source.
+
+    \b
+    FILE the export to import.
+    """
+    project = ctx.obj["project"]
+    try:
+        count = import_caches(project, file, force)
+    finally:
+        project.update()
+    logger.info(f"Imported {count} entries from {file}")
@@ -0,0 +1,61 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.commands.modules import gc_envs, prefetch as prefetch_cmd
+
+import click
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@click.group()
+def modules():
+    """Manage the environments of bark modules."""
+
+
+@modules.command()
+@click.pass_context
+def gc(ctx):
+    """
+    Remove unused environments.
+
+    Removes environments which are neither selected by, nor required by the
+    bark_rules history of, any repository using the environment store.
+    """
+    project = ctx.obj["project"]
+    try:
+        removed = gc_envs(project)
+    finally:
+        project.update()
+    logger.info(f"Removed {len(removed)} environments")
+
+
+@modules.command()
+@click.pass_context
+def prefetch(ctx):
+    """
+    Prefetch bark modules for offline installs.
+
+    Downloads and builds wheels for the requirements of every verified
+    bark_rules commit into the wheelhouse. Environments for prefetched
+    requirements are installed from the wheelhouse only, without accessing a
+    package index.
+    """
+    project = ctx.obj["project"]
+    try:
+        count = prefetch_cmd(project)
+    finally:
+        project.update()
+    logger.info(f"Prefetched {count} sets of requirements")
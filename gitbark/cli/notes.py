@@ -0,0 +1,95 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.commands.notes import (
+    publish_notes,
+    import_notes,
+    NOTES_REF,
+    DEFAULT_SAMPLE,
+)
+
+import click
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@click.group()
+def notes():
+    """Share validation results through git notes."""
+
+
+@notes.command()
+@click.pass_context
+@click.option("--ref", default=NOTES_REF, show_default=True, help="The notes ref.")
+@click.option("--sign", is_flag=True, default=False, help="Sign the notes commit.")
+def publish(ctx, ref, sign):
+    """
+    Publish cached validation results as notes.
+
+    The notes can then be shared using git push and git fetch.
+    """
+    project = ctx.obj["project"]
+    try:
+        count = publish_notes(project, ref, sign)
+    finally:
+        project.update()
+    logger.info(f"Published {count} results to {ref}")
+
+
+@notes.command("import")
+@click.pass_context
+@click.option("--ref", default=NOTES_REF, show_default=True, help="The notes ref.")
+@click.option(
+    "--sample",
+    type=click.IntRange(min=0),
+    default=DEFAULT_SAMPLE,
+    show_default=True,
+    help="Number of commits to re-validate before trusting the notes.",
+)
+@click.option(
+    "--trusted-key",
+    "trusted_keys",
+    multiple=True,
+    help="Fingerprint of a GPG key trusted to sign the notes. "
+    "Defaults to bark.notesTrustedKeys.",
+)
+@click.option(
+    "--allowed-signers",
+    type=click.Path(exists=True, dir_okay=False),
+    help="SSH allowed signers file, listing keys trusted to sign the notes. "
+    "Defaults to bark.notesAllowedSigners.",
+)
+@click.option(
+    "--allow-unsigned",
+    is_flag=True,
+    default=False,
+    help="Import notes which are not signed by a trusted key, relying on the "
+    "sample only.",
+)
+def import_notes_(ctx, ref, sample, trusted_keys, allowed_signers, allow_unsigned):
+    """
+    Import validation results from notes into the cache.
+
+    The notes commit must be signed by a trusted key, unless --allow-unsigned
+    is given.
+    """
+    project = ctx.obj["project"]
+    try:
+        count = import_notes(
+            project, ref, sample, trusted_keys, allowed_signers, allow_unsigned
+        )
+    finally:
+        project.update()
+    logger.info(f"Imported {count} results from {ref}")
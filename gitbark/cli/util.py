@@ -4,8 +4,9 @@ from collections.abc import MutableMapping
 from gitbark.project import Project
 from gitbark.rule import RuleViolation
 from gitbark.util import cmd
+from gitbark.registry import registry, COMMANDS_GROUP
 
-from importlib.metadata import entry_points
+import importlib
 import functools
 import click
 import sys
@@ -32,6 +33,26 @@ class BarkContextObject(MutableMapping):
         return iter(self._objects)
 
 
+class LazyGroup(click.Group):
+    """A click group which only imports subcommands when they are used.
+
+    lazy_subcommands maps command names to "module:attribute" strings.
+    """
+
+    def __init__(self, *args, lazy_subcommands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted(super().list_commands(ctx) + list(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands:
+            module, attr = self.lazy_subcommands[cmd_name].split(":")
+            return getattr(importlib.import_module(module), attr)
+        return super().get_command(ctx, cmd_name)
+
+
 class CliFail(Exception):
     def __init__(self, message, status=1):
         super().__init__(message)
@@ -115,6 +136,12 @@ def get_root() -> str:
     try:
         root = os.path.abspath(cmd("git", "rev-parse", "--show-toplevel")[0])
     except Exception:
+        # A bare repository has no working tree
+        try:
+            if cmd("git", "rev-parse", "--is-bare-repository")[0] == "true":
+                return os.path.abspath(cmd("git", "rev-parse", "--git-dir")[0])
+        except Exception:
+            pass
         raise CliFail(
             "Failed to find Git repository! Make sure "
             "you are not inside the .git directory."
@@ -135,8 +162,8 @@ def _add_subcommands(group: click.Group):
     except Exception:
         return
 
-    for ep in entry_points(group="bark_commands"):
-        group.add_command(ep.load())
+    for name in registry.names(COMMANDS_GROUP):
+        group.add_command(registry.load(COMMANDS_GROUP, name))
 
 
 def is_local_branch(branch: str):
@@ -155,10 +182,15 @@ def restore_incoming_changes():
         pass
 
 
-def pp_violation(violation: RuleViolation, indent: int = 0) -> None:
+def format_violation(violation: RuleViolation, indent: int = 0) -> str:
     if indent:
-        click.echo(("  " * (indent - 1)) + " - " + violation.message)
+        lines = [("  " * (indent - 1)) + " - " + violation.message]
     else:
-        click.echo(violation.message)
+        lines = [violation.message]
     for sub in violation.sub_violations:
-        pp_violation(sub, indent + 1)
+        lines.append(format_violation(sub, indent + 1))
+    return "\n".join(lines)
+
+
+def pp_violation(violation: RuleViolation) -> None:
+    click.echo(format_violation(violation))
@@ -0,0 +1,77 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Client for the bark daemon, used by hooks.
+
+Usage: python -m gitbark.client BARK_DIRECTORY ref-update OLD NEW REF
+       python -m gitbark.client BARK_DIRECTORY ref-update --stdin < UPDATES
+
+Only the standard library is imported here, to keep startup fast. If the
+daemon cannot handle the request, bark is run in-process instead.
+"""
+
+from typing import Any, Optional
+import socket
+import json
+import sys
+import os
+
+DAEMON_SOCKET = "daemon.sock"
+DAEMON_PYTHON = "daemon.python"
+
+
+def request(bark_directory: str, message: dict[str, Any]) -> Optional[dict]:
+    """Send a request to the daemon, returning None if it is not available."""
+    # Connect relative to the bark directory, as socket paths have a short limit
+    cwd = os.getcwd()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            os.chdir(bark_directory)
+            try:
+                s.connect(DAEMON_SOCKET)
+            finally:
+                os.chdir(cwd)
+            s.sendall(json.dumps(message).encode() + b"\n")
+            response = s.makefile("rb").readline()
+    except OSError:
+        return None
+    if not response:
+        return None
+    return json.loads(response)
+
+
+def main() -> None:
+    bark_directory, command, *args = sys.argv[1:]
+    message: dict[str, Any] = {"command": command, "args": args}
+    data = None
+    if "--stdin" in args:
+        data = sys.stdin.read()
+        message["updates"] = [line.split() for line in data.splitlines() if line]
+    response = request(bark_directory, message)
+    if response is None or response["status"] is None:
+        if data is None:
+            os.execvp("bark", ["bark", command, *args])
+        # Standard input has been consumed, so pass it on
+        import subprocess
+
+        status = subprocess.run(["bark", command, *args], input=data.encode())
+        sys.exit(status.returncode)
+
+    assert response is not None
+    sys.stdout.write(response["output"])
+    sys.exit(response["status"])
+
+
+if __name__ == "__main__":
+    main()
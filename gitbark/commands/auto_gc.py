@@ -0,0 +1,69 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ..project import Project
+
+from typing import Optional
+import subprocess
+import logging
+import time
+import sys
+import os
+
+logger = logging.getLogger(__name__)
+
+GC_MARKER = "gc.last"
+GC_INTERVAL_CONFIG = "bark.gcInterval"
+
+
+def _get_gc_interval(project: Project) -> Optional[int]:
+    """Get the automatic gc interval in days, or None if it is disabled."""
+    value = project.repo.get_config(GC_INTERVAL_CONFIG)
+    if not value:
+        return None
+    try:
+        interval = int(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {GC_INTERVAL_CONFIG}: {value}")
+        return None
+    return interval if interval > 0 else None
+
+
+def maybe_auto_gc(project: Project) -> None:
+    """Start a background gc if the configured interval has passed.
+
+    The interval is read from the bark.gcInterval git config, in days.
+    Automatic gc is disabled if it is unset or 0.
+    """
+    interval = _get_gc_interval(project)
+    if interval is None:
+        return
+
+    marker = os.path.join(project.bark_directory, GC_MARKER)
+    if os.path.exists(marker):
+        if os.path.getmtime(marker) > time.time() - interval * 86400:
+            return
+
+    # Touch the marker first, to avoid starting several collections
+    with open(marker, "w"):
+        pass
+    logger.debug("Starting automatic cache gc")
+    subprocess.Popen(
+        [sys.executable, "-m", "gitbark.cli", "cache", "gc"],
+        cwd=project.path,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
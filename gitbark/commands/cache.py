@@ -0,0 +1,318 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ..core import get_bark_rules, get_rules_fingerprint
+from ..cache import Cache
+from ..git import Commit
+from ..project import Project
+from ..cli.util import CliFail
+from .auto_gc import GC_MARKER
+
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+import contextlib
+import subprocess
+import struct
+import mmap
+import sqlite3
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRACE_PERIOD = 14  # days, same as git's default gc.pruneExpire
+
+# Keep batches below SQLITE_MAX_VARIABLE_NUMBER for older SQLite versions
+_BATCH_SIZE = 500
+
+# Cache export format, all integers big endian:
+#   header:  magic, version (u8), rules fingerprint (32 bytes), section count (u32)
+#   section: bootstrap (20 bytes), entry count (u32), sorted raw commit hashes
+#            (20 bytes each), validity bits (1 bit per entry, LSB first, padded)
+EXPORT_MAGIC = b"BARKCACHE"
+EXPORT_VERSION = 1
+_HEADER = struct.Struct(">9sB32sI")
+_SECTION = struct.Struct(">20sI")
+_OID_SIZE = 20
+
+
+@dataclass
+class GcResult:
+    entries_removed: int = 0
+    caches_removed: int = 0
+    bytes_reclaimed: int = 0
+
+
+def _load_reachable(project: Project, db: sqlite3.Connection) -> None:
+    """Stream all commits reachable from refs (or reflogs) into db."""
+    db.execute("CREATE TABLE reachable (commit_hash TEXT PRIMARY KEY) WITHOUT ROWID")
+    with subprocess.Popen(
+        ["git", "rev-list", "--all", "--reflog"],
+        cwd=project.path,
+        stdout=subprocess.PIPE,
+        text=True,
+    ) as proc:
+        assert proc.stdout is not None
+        batch: list[tuple[str]] = []
+        for line in proc.stdout:
+            batch.append((line.strip(),))
+            if len(batch) >= _BATCH_SIZE:
+                db.executemany("INSERT OR IGNORE INTO reachable VALUES (?)", batch)
+                batch.clear()
+        db.executemany("INSERT OR IGNORE INTO reachable VALUES (?)", batch)
+    if proc.returncode:
+        raise CliFail("Failed to list reachable commits")
+
+
+def _is_expired(project: Project, commit_hash: bytes, expiry: float) -> bool:
+    try:
+        commit = Commit(commit_hash, project.repo)
+    except ValueError:
+        # The commit no longer exists in the repository
+        return True
+    return commit.commit_time < expiry
+
+
+def _prune_batch(
+    project: Project,
+    cache: Cache,
+    reachable: sqlite3.Connection,
+    hashes: list[bytes],
+    expiry: float,
+) -> int:
+    hex_hashes = [h.hex() for h in hashes]
+    found = {
+        row[0]
+        for row in reachable.execute(
+            "SELECT commit_hash FROM reachable WHERE commit_hash IN "
+            f"({','.join('?' * len(hex_hashes))})",
+            hex_hashes,
+        )
+    }
+    stale = [
+        h for h in hashes if h.hex() not in found and _is_expired(project, h, expiry)
+    ]
+    cache.remove_many(stale)
+    return len(stale)
+
+
+def _prune_cache(
+    project: Project, cache: Cache, reachable: sqlite3.Connection, expiry: float
+) -> int:
+    removed = 0
+    batch: list[bytes] = []
+    for commit_hash, _ in cache.entries(_BATCH_SIZE):
+        batch.append(commit_hash)
+        if len(batch) >= _BATCH_SIZE:
+            removed += _prune_batch(project, cache, reachable, batch, expiry)
+            batch = []
+    if batch:
+        removed += _prune_batch(project, cache, reachable, batch, expiry)
+    return removed
+
+
+def _get_listed_bootstraps(project: Project) -> set[Commit]:
+    """Get the bootstraps of bark_rules and of every entry in bark_rules.yaml."""
+    hashes = [
+        bytes.fromhex(entry["bootstrap"])
+        for entry in get_bark_rules(project).project or []
+    ]
+    bootstraps = {project.bootstrap} if project.bootstrap else set()
+    for h in hashes:
+        try:
+            bootstraps.add(Commit(h, project.repo))
+        except ValueError:
+            logger.debug(f"Bootstrap {h.hex()} does not exist")
+    return bootstraps
+
+
+def gc(project: Project, grace_period: int = DEFAULT_GRACE_PERIOD) -> GcResult:
+    """Remove stale cache entries and unused caches.
+
+    Entries for commits that are no longer reachable from any ref are removed,
+    unless the commit is younger than grace_period days. Caches for bootstraps
+    that are no longer used by bark_rules are deleted, and the remaining caches
+    are compacted.
+    """
+    result = GcResult()
+    expiry = time.time() - grace_period * 86400
+
+    in_use = set()
+    for listed in _get_listed_bootstraps(project):
+        cache = project.find_cache(listed)
+        if cache:
+            in_use.add(cache.path)
+
+    for bootstrap, cache in project.get_caches().items():
+        if cache.path not in in_use:
+            logger.debug(f"Removing cache for bootstrap {bootstrap.hex()}")
+            result.bytes_reclaimed += cache.size
+            result.caches_removed += 1
+            project.remove_cache(bootstrap)
+
+    # Temporary databases are stored on disk, keeping memory usage bounded
+    with contextlib.closing(sqlite3.connect("")) as reachable:
+        _load_reachable(project, reachable)
+        for cache in project.get_caches().values():
+            size = cache.size
+            result.entries_removed += _prune_cache(project, cache, reachable, expiry)
+            cache.compact()
+            result.bytes_reclaimed += size - cache.size
+
+    with open(os.path.join(project.bark_directory, GC_MARKER), "w"):
+        pass
+    return result
+
+
+class _ExportSection:
+    """The entries for one bootstrap, read from a cache export."""
+
+    def __init__(self, data: mmap.mmap, offset: int) -> None:
+        self._data = data
+        self.bootstrap, self.count = _SECTION.unpack_from(data, offset)
+        self._oids = offset + _SECTION.size
+        self._bits = self._oids + self.count * _OID_SIZE
+        self.end = self._bits + (self.count + 7) // 8
+
+    def __iter__(self) -> Iterator[tuple[bytes, bool]]:
+        for i in range(self.count):
+            offset = self._oids + i * _OID_SIZE
+            oid = self._data[offset : offset + _OID_SIZE]
+            yield oid, bool(self._data[self._bits + i // 8] >> (i % 8) & 1)
+
+
+def _read_export(data: mmap.mmap) -> tuple[bytes, list[_ExportSection]]:
+    try:
+        magic, version, fingerprint, n_sections = _HEADER.unpack_from(data, 0)
+    except struct.error:
+        raise ValueError("Not a cache export")
+    if magic != EXPORT_MAGIC:
+        raise ValueError("Not a cache export")
+    if version != EXPORT_VERSION:
+        raise ValueError(f"Unsupported cache export version: {version}")
+
+    sections = []
+    offset = _HEADER.size
+    for _ in range(n_sections):
+        try:
+            section = _ExportSection(data, offset)
+        except struct.error:
+            raise ValueError("Truncated cache export")
+        sections.append(section)
+        offset = section.end
+    if offset > len(data):
+        raise ValueError("Truncated cache export")
+    return fingerprint, sections
+
+
+@contextlib.contextmanager
+def _open_export(path: str) -> Iterator[tuple[bytes, list[_ExportSection]]]:
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            raise CliFail(f"{path} is not a cache export")
+        with data:
+            try:
+                yield _read_export(data)
+            except ValueError as e:
+                raise CliFail(f"{path}: {e}")
+
+
+def _skip_known(
+    entries: Iterable[tuple[bytes, bool]], base: Optional[_ExportSection]
+) -> Iterator[tuple[bytes, bool]]:
+    """Yield entries not in base, with both sorted by commit hash."""
+    if base is None:
+        yield from entries
+        return
+
+    base_entries = iter(base)
+    known = next(base_entries, None)
+    for entry in entries:
+        while known is not None and known[0] < entry[0]:
+            known = next(base_entries, None)
+        if entry != known:
+            yield entry
+
+
+def export_caches(project: Project, path: str, base: Optional[str] = None) -> int:
+    """Write all caches to a file, returning the number of exported entries.
+
+    If base is given, only entries not already in that export are written, so
+    that exports can be produced incrementally. The base is ignored if it was
+    made using different rules.
+    """
+    fingerprint = get_rules_fingerprint(project)
+    total = 0
+    with contextlib.ExitStack() as stack:
+        known: dict[bytes, _ExportSection] = {}
+        if base:
+            base_fingerprint, sections = stack.enter_context(_open_export(base))
+            if base_fingerprint == fingerprint:
+                known = {s.bootstrap: s for s in sections}
+            else:
+                logger.warning("Base export uses different rules, ignoring it")
+
+        # Write to a temporary file, so that base may be the same as path
+        out = stack.enter_context(open(f"{path}.tmp", "wb"))
+        caches = project.get_caches()
+        out.write(_HEADER.pack(EXPORT_MAGIC, EXPORT_VERSION, fingerprint, len(caches)))
+        for bootstrap, cache in caches.items():
+            start = out.tell()
+            out.write(_SECTION.pack(bootstrap, 0))
+            count = 0
+            bits = bytearray()
+            for oid, valid in _skip_known(cache.entries(), known.get(bootstrap)):
+                out.write(oid)
+                if count % 8 == 0:
+                    bits.append(0)
+                if valid:
+                    bits[-1] |= 1 << (count % 8)
+                count += 1
+            out.write(bits)
+
+            # Fill in the entry count now that it is known
+            end = out.tell()
+            out.seek(start)
+            out.write(_SECTION.pack(bootstrap, count))
+            out.seek(end)
+            total += count
+    os.replace(f"{path}.tmp", path)
+    return total
+
+
+def import_caches(project: Project, path: str, force: bool = False) -> int:
+    """Merge a cache export into the local caches.
+
+    Entries already present in the local caches are kept. Returns the number
+    of entries read.
+    """
+    total = 0
+    with _open_export(path) as (fingerprint, sections):
+        if fingerprint != get_rules_fingerprint(project) and not force:
+            raise CliFail("The cache export was made using different bark modules")
+
+        for section in sections:
+            try:
+                bootstrap = Commit(section.bootstrap, project.repo)
+            except ValueError:
+                logger.warning(
+                    f"Skipping cache for unknown bootstrap {section.bootstrap.hex()}"
+                )
+                continue
+            project.get_cache(bootstrap).set_many(section)
+            total += section.count
+    return total
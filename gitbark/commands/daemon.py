@@ -0,0 +1,173 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .auto_gc import maybe_auto_gc
+from ..verifier import Verifier
+from ..rule import RuleViolation
+from ..project import Project, PROJECT_FILES
+from ..client import request, DAEMON_SOCKET, DAEMON_PYTHON
+from ..cli.util import CliFail, format_violation
+
+from typing import Any, Optional
+import socketserver
+import logging
+import json
+import sys
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def _get_mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class _CaptureHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.lines: list[str] = []
+
+    def emit(self, record) -> None:
+        self.lines.append(record.getMessage())
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    def handle(self) -> None:
+        try:
+            message = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        response = self.server.daemon.handle(message)
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class _Server(socketserver.UnixStreamServer):
+    def __init__(self, daemon: "Daemon", path: str) -> None:
+        super().__init__(path, _RequestHandler)
+        self.daemon = daemon
+
+
+class Daemon:
+    """Serves ref update verifications for a repository over a Unix socket.
+
+    A Verifier is kept between requests, holding the project, its caches,
+    loaded rule modules and verified bark rules. The daemon restarts itself
+    when the env changes, as modules which are already imported cannot be
+    reloaded.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.verifier = Verifier(path)
+        self._env_state = self._get_env_state()
+        self._stopped = False
+        self._restart = False
+
+    def _get_env_state(self) -> Optional[int]:
+        return _get_mtime(
+            os.path.join(
+                self.verifier.project.bark_directory, PROJECT_FILES.ENV_METADATA
+            )
+        )
+
+    def _check_env(self) -> bool:
+        """Check that the env is unchanged, otherwise schedule a restart."""
+        if self._get_env_state() != self._env_state:
+            logger.info("The env has changed, restarting")
+            self._restart = True
+            return False
+        return True
+
+    def handle(self, message: dict[str, Any]) -> dict[str, Any]:
+        """Handle a request, a None status tells the client to run bark itself."""
+        command = message.get("command")
+        if command == "stop":
+            self._stopped = True
+            return {"status": 0, "output": ""}
+        if command != "ref-update" or not self._check_env():
+            return {"status": None}
+
+        # All updates of the transaction, or a single one given as arguments
+        args = [arg for arg in message["args"] if not arg.startswith("-")]
+        updates = message["updates"] if "updates" in message else [args]
+        all_commits = "--all-commits" in message["args"]
+        capture = _CaptureHandler()
+        logging.getLogger().addHandler(capture)
+        try:
+            results = self.verifier.verify_ref_updates(
+                [(old, new, ref) for old, new, ref in updates], all_commits
+            )
+        except Exception:
+            logger.exception("Failed to handle request")
+            return {"status": None}
+        finally:
+            logging.getLogger().removeHandler(capture)
+
+        status = 0
+        violations = [r.violation for r in results if r.violation]
+        if violations:
+            violation = (
+                violations[0]
+                if len(violations) == 1
+                else RuleViolation("Not all refs were valid", violations)
+            )
+            capture.lines.append(format_violation(violation))
+            status = 1
+        elif results:
+            maybe_auto_gc(self.verifier.project)
+
+        # Modules may have been installed while verifying
+        self._check_env()
+        output = "".join(f"{line}\n" for line in capture.lines)
+        return {"status": status, "output": output}
+
+    def serve(self) -> None:
+        project = self.verifier.project
+        bark_directory = project.bark_directory
+        if request(bark_directory, {"command": "ping"}) is not None:
+            raise CliFail("The bark daemon is already running")
+
+        # Bind relative to the bark directory, as socket paths have a short limit
+        os.chdir(bark_directory)
+        if os.path.exists(DAEMON_SOCKET):
+            os.remove(DAEMON_SOCKET)
+        server = _Server(self, DAEMON_SOCKET)
+        os.chdir(project.path)
+        python_file = os.path.join(bark_directory, DAEMON_PYTHON)
+        with open(python_file, "w") as f:
+            f.write(sys.executable)
+
+        logger.info(f"Serving requests for {project.path}")
+        try:
+            while not (self._stopped or self._restart):
+                server.handle_request()
+        finally:
+            server.server_close()
+            for name in (DAEMON_SOCKET, DAEMON_PYTHON):
+                path = os.path.join(bark_directory, name)
+                if os.path.exists(path):
+                    os.remove(path)
+            self.verifier.close()
+
+        if self._restart:
+            os.execv(sys.executable, [sys.executable, "-m", "gitbark.cli", "daemon"])
+
+
+def stop_daemon(project: Project) -> None:
+    if request(project.bark_directory, {"command": "stop"}) is None:
+        raise CliFail("The bark daemon is not running")
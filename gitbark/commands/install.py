@@ -14,7 +14,7 @@
 
 from ..project import Project
 
-import pkg_resources
+from importlib.resources import files
 import os
 import stat
 import logging
@@ -22,26 +22,41 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def install(project: Project) -> None:
+def install(project: Project, pre_push: bool = False) -> None:
     """
     Installs GitBark
     """
-    if not hooks_installed(project):
-        install_hooks(project)
+    if not hooks_installed(project, pre_push):
+        install_hooks(project, pre_push)
 
 
-def install_hooks(project: Project):
-    logger.debug("Installing hooks...")
-    reference_transaction_data = pkg_resources.resource_string(
-        __name__, "hooks/reference_transaction"
-    )
+def get_hooks(project: Project, pre_push: bool = False) -> list[str]:
+    """Get the hooks used by GitBark in a repository.
+
+    Bare repositories receive pushes, which are verified before being accepted.
+    The pre-push hook verifies outgoing refs before pushing them.
+    """
+    if project.repo.is_bare:
+        return ["pre-receive"]
+    if pre_push:
+        return ["reference-transaction", "pre-push"]
+    return ["reference-transaction"]
+
+
+def _read_hook(name: str) -> bytes:
+    return files(__package__).joinpath(f"hooks/{name.replace('-', '_')}").read_bytes()
 
-    hooks_path = f"{project.path}/.git/hooks"
-    reference_transaction_path = f"{hooks_path}/reference-transaction"
 
-    with open(reference_transaction_path, "wb") as f:
-        f.write(reference_transaction_data)
-    make_executable(reference_transaction_path)
+def install_hooks(project: Project, pre_push: bool = False):
+    logger.debug("Installing hooks...")
+    hooks_path = os.path.join(project.repo.common_dir, "hooks")
+    os.makedirs(hooks_path, exist_ok=True)
+
+    for name in get_hooks(project, pre_push):
+        hook_path = f"{hooks_path}/{name}"
+        with open(hook_path, "wb") as f:
+            f.write(_read_hook(name))
+        make_executable(hook_path)
 
     logger.info(f"Hooks installed in {hooks_path}")
 
@@ -54,19 +69,16 @@ def make_executable(path: str):
     os.chmod(path, new_permissions)
 
 
-def hooks_installed(project: Project):
-    reference_transaction_data = pkg_resources.resource_string(
-        __name__, "hooks/reference_transaction"
-    ).decode()
-
-    hooks_path = f"{project.path}/.git/hooks"
-    reference_transaction_path = f"{hooks_path}/reference-transaction"
+def hooks_installed(project: Project, pre_push: bool = False):
+    hooks_path = os.path.join(project.repo.common_dir, "hooks")
 
-    if not os.path.exists(reference_transaction_path):
-        return False
-
-    with open(reference_transaction_path, "r") as f:
-        if not f.read() == reference_transaction_data:
+    for name in get_hooks(project, pre_push):
+        hook_path = f"{hooks_path}/{name}"
+        if not os.path.exists(hook_path):
             return False
 
+        with open(hook_path, "rb") as f:
+            if not f.read() == _read_hook(name):
+                return False
+
     return True
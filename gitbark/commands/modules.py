@@ -0,0 +1,121 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ..core import BARK_RULES_REF, BARK_REQUIREMENTS
+from ..env import get_requirements_hash
+from ..git import Repository
+from ..project import Project, PROJECT_FILES, get_bark_directory
+
+from typing import Optional
+import shutil
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Where the env was kept before envs were keyed by requirements
+LEGACY_ENV_DIRECTORY = "env"
+
+
+def get_requirements_history(repo: Repository) -> dict[str, bytes]:
+    """Get the distinct requirements in the bark_rules history, keyed by hash."""
+    head = repo.references.get(BARK_RULES_REF)
+    if not head:
+        return {}
+    requirements = {}
+    for commit in repo.walk(head):
+        try:
+            content = commit.read_file(BARK_REQUIREMENTS)
+        except FileNotFoundError:
+            continue
+        requirements[get_requirements_hash(content)] = content
+    return requirements
+
+
+def _get_valid_requirements(project: Project) -> dict[str, bytes]:
+    """Get the distinct requirements of the bark_rules commits known to be valid.
+
+    These are the bootstrap, and the commits cached as valid using it.
+    """
+    head = project.repo.references.get(BARK_RULES_REF)
+    bootstrap = project.bootstrap
+    if not head or not bootstrap:
+        return {}
+    cache = project.find_cache(bootstrap)
+    requirements = {}
+    for commit in project.repo.walk(head):
+        if commit != bootstrap and not (cache and cache.get(commit)):
+            continue
+        try:
+            content = commit.read_file(BARK_REQUIREMENTS)
+        except FileNotFoundError:
+            continue
+        requirements[get_requirements_hash(content)] = content
+    return requirements
+
+
+def prefetch(project: Project) -> int:
+    """Prefetch the wheels for the requirements of valid bark_rules commits.
+
+    Commits which have not been verified are skipped, as building their
+    requirements may run untrusted code. Returns the number of newly
+    prefetched sets of requirements.
+    """
+    store = project.get_env_store()
+    return sum(
+        store.prefetch(requirements)
+        for requirements in _get_valid_requirements(project).values()
+    )
+
+
+def _get_selected_env(repo: Repository) -> Optional[str]:
+    metadata_file = os.path.join(get_bark_directory(repo), PROJECT_FILES.ENV_METADATA)
+    try:
+        with open(metadata_file, "r") as f:
+            return json.load(f).get("requirements_hash")
+    except (OSError, ValueError):
+        return None
+
+
+def gc_envs(project: Project) -> list[str]:
+    """Remove envs not used by any repository of the env store.
+
+    An env is used by a repository if it is selected, or if its requirements
+    are in the bark_rules history. Returns the hashes of the removed envs.
+    """
+    store = project.get_env_store()
+    used: set[str] = set()
+    for path in store.repositories():
+        if not Project.exists(path):
+            logger.debug(f"Skipping missing repository {path}")
+            continue
+        repo = Repository(path)
+        used.update(get_requirements_history(repo))
+        selected = _get_selected_env(repo)
+        if selected:
+            used.add(selected)
+
+    removed = []
+    for requirements_hash in store.envs():
+        if requirements_hash not in used:
+            if store.remove_env(requirements_hash):
+                removed.append(requirements_hash)
+            else:
+                logger.debug(f"Skipping env {requirements_hash}, which is in use")
+
+    legacy = os.path.join(project.bark_directory, LEGACY_ENV_DIRECTORY)
+    if os.path.isdir(legacy):
+        shutil.rmtree(legacy)
+    return removed
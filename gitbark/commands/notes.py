@@ -0,0 +1,282 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ..core import validate_commit_rules, get_rules_fingerprint
+from ..cache import Cache
+from ..git import Commit
+from ..rule import RuleViolation
+from ..project import Project, NOTES_TRUSTED_KEYS_CONFIG, NOTES_ALLOWED_SIGNERS_CONFIG
+from ..cli.util import CliFail
+
+from typing import Iterable, Iterator, Optional
+import subprocess
+import logging
+import random
+import os
+
+logger = logging.getLogger(__name__)
+
+NOTES_REF = "refs/notes/bark"
+DEFAULT_SAMPLE = 10
+
+# Each note holds one line per bootstrap:
+#   bark <version> <bootstrap> <valid (0 or 1)> <rules fingerprint>
+_NOTE_PREFIX = "bark"
+_NOTE_VERSION = "1"
+
+_SSH_SIGNATURE = b"-----BEGIN SSH SIGNATURE-----"
+_PGP_SIGNATURE = b"-----BEGIN PGP SIGNATURE-----"
+
+
+def _format_line(bootstrap: bytes, valid: bool, fingerprint: bytes) -> str:
+    return (
+        f"{_NOTE_PREFIX} {_NOTE_VERSION} {bootstrap.hex()} {int(valid)} "
+        f"{fingerprint.hex()}"
+    )
+
+
+def _parse_lines(note: str) -> Iterator[tuple[bytes, bool, bytes]]:
+    for line in note.splitlines():
+        parts = line.split()
+        if len(parts) == 5 and parts[:2] == [_NOTE_PREFIX, _NOTE_VERSION]:
+            try:
+                yield bytes.fromhex(parts[2]), parts[3] == "1", bytes.fromhex(parts[4])
+            except ValueError:
+                continue
+
+
+def _update_note(note: str, bootstrap: bytes, line: str) -> str:
+    """Replace the line for bootstrap in a note, keeping any other content."""
+    prefix = f"{_NOTE_PREFIX} {_NOTE_VERSION} {bootstrap.hex()} "
+    lines = [ln for ln in note.splitlines() if not ln.startswith(prefix)]
+    return "\n".join(lines + [line]) + "\n"
+
+
+def publish_notes(project: Project, ref: str = NOTES_REF, sign: bool = False) -> int:
+    """Publish the cached validation results as notes.
+
+    Returns the number of published results.
+    """
+    fingerprint = get_rules_fingerprint(project)
+    notes = project.repo.read_notes(ref)
+    count = 0
+    for bootstrap, cache in project.get_caches().items():
+        for commit_hash, valid in cache.entries():
+            try:
+                Commit(commit_hash, project.repo)
+            except ValueError:
+                continue  # Only annotate commits that exist
+            line = _format_line(bootstrap, valid, fingerprint)
+            notes[commit_hash] = _update_note(
+                notes.get(commit_hash, ""), bootstrap, line
+            )
+            count += 1
+    project.repo.write_notes(ref, notes, "Publish bark validation results", sign)
+    return count
+
+
+class _OverlayCache(Cache):
+    """A cache extended with untrusted entries, hiding one commit.
+
+    Entries set during validation are kept in memory, and are not written back
+    to the underlying cache.
+    """
+
+    def __init__(self, cache: Cache, entries: dict[bytes, bool], hidden: Commit):
+        super().__init__(cache.path)
+        self._cache = cache
+        self._entries = entries
+        self._hidden = hidden.hash
+        self._added: dict[bytes, bool] = {}
+
+    def get(self, commit: Commit) -> Optional[bool]:
+        if commit.hash in self._added:
+            return self._added[commit.hash]
+        if commit.hash == self._hidden:
+            return None
+        valid = self._cache.get(commit)
+        return valid if valid is not None else self._entries.get(commit.hash)
+
+    def set(self, commit: Commit, valid: bool) -> None:
+        if self.get(commit) is None:
+            self._added[commit.hash] = valid
+
+    def remove(self, commit: Commit) -> None:
+        self._added.pop(commit.hash, None)
+
+    def entries(self, batch_size: int = 1000) -> Iterator[tuple[bytes, bool]]:
+        entries = dict(self._entries)
+        entries.update(self._cache.entries(batch_size))
+        entries.pop(self._hidden, None)
+        entries.update(self._added)
+        return iter(sorted(entries.items()))
+
+    def set_many(self, entries: Iterable[tuple[bytes, bool]]) -> None:
+        for commit_hash, valid in entries:
+            self._added.setdefault(commit_hash, valid)
+
+    def remove_many(self, hashes: Iterable[bytes]) -> None:
+        for commit_hash in hashes:
+            self._added.pop(commit_hash, None)
+
+    def compact(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _check_sample(
+    project: Project,
+    cache: Cache,
+    bootstrap: Commit,
+    entries: dict[bytes, bool],
+    sample: int,
+) -> None:
+    """Re-validate a random sample of the commits not already cached.
+
+    Each sampled commit is validated against the rules of its parents, trusting
+    the results of the notes for the parents.
+    """
+    candidates = []
+    for commit_hash in entries:
+        try:
+            commit = Commit(commit_hash, project.repo)
+        except ValueError:
+            continue
+        if commit != bootstrap and cache.get(commit) is None:
+            candidates.append(commit)
+
+    for commit in random.sample(candidates, min(sample, len(candidates))):
+        overlay = _OverlayCache(cache, entries, commit)
+        try:
+            validate_commit_rules(overlay, commit, bootstrap)
+            valid = True
+        except RuleViolation:
+            valid = False
+        if valid != entries[commit.hash]:
+            raise CliFail(
+                f"Noted result for commit {commit.hash.hex()} does not match "
+                "the recomputed result!"
+            )
+
+
+def _gpg_signers(status: str) -> set[str]:
+    """Get the fingerprints of the key and primary key of a valid signature."""
+    signers = set()
+    for line in status.splitlines():
+        parts = line.split()
+        if parts[:2] == ["[GNUPG:]", "VALIDSIG"]:
+            signers.update(parts[2:3] + parts[11:12])
+    return signers
+
+
+def _verify_signer(
+    project: Project,
+    ref: str,
+    trusted_keys: set[str],
+    allowed_signers: Optional[str],
+) -> None:
+    """Check that the tip of ref is signed by a trusted key.
+
+    A GPG signature must be made by one of trusted_keys, and an SSH signature
+    by a key in the allowed_signers file. Other keys known to git or GPG are
+    not trusted.
+    """
+    tip, _ = project.repo.resolve(ref)
+    signature, _ = tip.signature
+    args = None
+    if signature and signature.startswith(_SSH_SIGNATURE) and allowed_signers:
+        args = ["-c", f"gpg.ssh.allowedSignersFile={allowed_signers}"]
+    elif signature and signature.startswith(_PGP_SIGNATURE) and trusted_keys:
+        args = []
+    if args is not None:
+        result = subprocess.run(
+            ["git", *args, "verify-commit", "--raw", tip.hash.hex()],
+            capture_output=True,
+            text=True,
+            cwd=project.path,
+        )
+        if result.returncode == 0 and (
+            args or _gpg_signers(result.stderr) & trusted_keys
+        ):
+            return
+    raise CliFail(f"The tip of {ref} is not signed by a trusted key!")
+
+
+def import_notes(
+    project: Project,
+    ref: str = NOTES_REF,
+    sample: int = DEFAULT_SAMPLE,
+    trusted_keys: Iterable[str] = (),
+    allowed_signers: Optional[str] = None,
+    allow_unsigned: bool = False,
+) -> int:
+    """Import validation results from notes into the local caches.
+
+    Only results made using the same rules are imported. The tip of ref must
+    be signed by one of trusted_keys (GPG fingerprints, by default read from
+    bark.notesTrustedKeys), or by a key in the allowed_signers file (by default
+    read from bark.notesAllowedSigners), unless allow_unsigned is set. In
+    addition, re-validating a random sample of the commits must give the same
+    results. Returns the number of imported results.
+    """
+    notes = project.repo.read_notes(ref)
+    if not notes:
+        raise CliFail(f"No notes found in {ref}")
+
+    if allow_unsigned:
+        if sample < 1:
+            raise CliFail("Unsigned notes can only be imported with a sample")
+    else:
+        trusted_keys = (
+            trusted_keys
+            or (project.repo.get_config(NOTES_TRUSTED_KEYS_CONFIG) or "").split()
+        )
+        allowed_signers = allowed_signers or project.repo.get_config(
+            NOTES_ALLOWED_SIGNERS_CONFIG
+        )
+        if not trusted_keys and not allowed_signers:
+            raise CliFail(
+                "No keys are trusted to sign notes, set "
+                f"{NOTES_TRUSTED_KEYS_CONFIG} or {NOTES_ALLOWED_SIGNERS_CONFIG}"
+            )
+        _verify_signer(
+            project,
+            ref,
+            {key.replace(" ", "").upper() for key in trusted_keys},
+            os.path.expanduser(allowed_signers) if allowed_signers else None,
+        )
+
+    fingerprint = get_rules_fingerprint(project)
+    results: dict[bytes, dict[bytes, bool]] = {}
+    for commit_hash, note in notes.items():
+        for bootstrap_hash, valid, note_fingerprint in _parse_lines(note):
+            if note_fingerprint == fingerprint:
+                results.setdefault(bootstrap_hash, {})[commit_hash] = valid
+
+    count = 0
+    for bootstrap_hash, entries in results.items():
+        try:
+            bootstrap = Commit(bootstrap_hash, project.repo)
+        except ValueError:
+            logger.warning(
+                f"Skipping notes for unknown bootstrap {bootstrap_hash.hex()}"
+            )
+            continue
+        cache = project.get_cache(bootstrap)
+        _check_sample(project, cache, bootstrap, entries, sample)
+        cache.set_many(sorted(entries.items()))
+        count += len(entries)
+    return count
@@ -0,0 +1,105 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ..project import Project, PROJECT_FILES
+from ..objects import BarkRules
+from ..git import Commit
+from ..util import atomic_write
+
+from typing import Optional
+import os
+
+
+def _has_top_level_branch(pattern: str) -> bool:
+    """Check if a regular expression has an alternation outside of any group."""
+    depth = 0
+    in_class = False
+    escaped = False
+    for c in pattern:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif in_class:
+            in_class = c != "]"
+        elif c == "[":
+            in_class = True
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return True
+    return False
+
+
+def get_ref_prefix(pattern: str) -> str:
+    """Get a literal prefix shared by all refs a ref rule pattern matches.
+
+    Patterns are matched from the start of the ref, so a ref which does not
+    start with the prefix cannot match. The prefix is empty if the pattern
+    does not start with a literal.
+    """
+    if _has_top_level_branch(pattern):
+        return ""
+    prefix = ""
+    i = 1 if pattern.startswith("^") else 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            c = pattern[i + 1]
+            i += 2
+        elif c in ".^$*+?{}[]()|\\":
+            break
+        else:
+            i += 1
+        quantifier = pattern[i] if i < len(pattern) else ""
+        if quantifier in ("*", "?", "{"):
+            # The character may be left out
+            break
+        prefix += c
+        if quantifier == "+":
+            break
+    return prefix
+
+
+def read_ref_prefilter(project: Project) -> Optional[bytes]:
+    """Get the bark_rules commit the ref prefilter was generated from."""
+    path = os.path.join(project.bark_directory, PROJECT_FILES.REF_PREFILTER)
+    try:
+        with open(path, "r") as f:
+            return bytes.fromhex(f.readline().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def write_ref_prefilter(project: Project, head: Commit, bark_rules: BarkRules) -> None:
+    """Write the prefixes of refs matched by the rules of a verified bark_rules.
+
+    The hook only runs bark for updates of refs starting with one of these,
+    while the bark_rules branch is at head. If a rule can match any ref, the
+    prefilter is removed.
+    """
+    path = os.path.join(project.bark_directory, PROJECT_FILES.REF_PREFILTER)
+    rules = [bark_rules.get_bark_rules(b""), *bark_rules.get_ref_rules()]
+    prefixes = {get_ref_prefix(r.pattern.pattern) for r in rules}
+    if "" in prefixes:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    with atomic_write(path) as f:
+        f.write(f"{head.hash.hex()}\n")
+        for prefix in sorted(prefixes):
+            f.write(f"{prefix}\n")
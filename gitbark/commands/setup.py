@@ -23,10 +23,10 @@ from ..objects import BarkRules, RuleData
 from ..git import Commit, COMMIT_RULES, BARK_CONFIG, BRANCH_REF_PREFIX
 from ..project import Project
 from ..util import cmd
+from ..registry import registry
 
 from ..cli.util import click_prompt, CliFail
 
-from importlib.metadata import entry_points
 from dataclasses import asdict
 from typing import Optional
 
@@ -145,12 +145,12 @@ def branch_in_bark_rules_yaml(project: Project, branch: str) -> bool:
 
 
 def save_active_branch(project: Project, branch: str) -> None:
-    with open(f"{project.bark_directory}/{ACTIVE_BRANCH}", "w") as f:
+    with open(f"{project.worktree_directory}/{ACTIVE_BRANCH}", "w") as f:
         f.write(branch)
 
 
 def get_active_branch(project: Project) -> Optional[str]:
-    file = f"{project.bark_directory}/{ACTIVE_BRANCH}"
+    file = f"{project.worktree_directory}/{ACTIVE_BRANCH}"
     if os.path.exists(file):
         with open(file, "r") as f:
             return f.read()
@@ -158,11 +158,13 @@ def get_active_branch(project: Project) -> Optional[str]:
 
 
 def remove_active_branch(project: Project):
-    os.remove(f"{project.bark_directory}/{ACTIVE_BRANCH}")
+    os.remove(f"{project.worktree_directory}/{ACTIVE_BRANCH}")
 
 
 def add_rules_interactive(ep_group: str, rules: list) -> None:
-    bark_rules = [(ep.name, ep.load()) for ep in entry_points(group=ep_group)]
+    bark_rules = [
+        (name, registry.load(ep_group, name)) for name in registry.names(ep_group)
+    ]
     choices = {}
     idx = 0
     for name, rule in bark_rules:
@@ -0,0 +1,84 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ..core import (
+    get_bark_rules,
+    get_bark_rules_commit,
+    get_rules_fingerprint,
+    BARK_RULES_REF,
+)
+from ..objects import RefRuleData
+from ..git import Commit
+from ..project import Project
+from ..cache import Cache
+from .verify import get_ref_rules_fingerprint
+
+from enum import Enum
+from typing import Optional
+
+
+class RefStatus(str, Enum):
+    VALID = "valid"
+    INVALID = "invalid"
+    UNKNOWN = "unknown"
+
+
+def get_status(project: Project) -> dict[str, tuple[Commit, RefStatus]]:
+    """Get the status of each ref with rules, without validating anything.
+
+    A ref is known to be valid or invalid if its target was verified with its
+    current rules, or invalid if its target is cached as invalid by any of its
+    bootstraps. Otherwise its status is unknown.
+    """
+    bark_rules = get_bark_rules(project)
+    modules = get_rules_fingerprint(project)
+    validator = get_bark_rules_commit(project)
+    snapshot = project.get_ref_states()
+    rules = bark_rules.get_ref_rules()
+    caches: dict[bytes, Optional[Cache]] = {}
+
+    def is_invalid(head: Commit, ref_rules: list[RefRuleData]) -> bool:
+        for rule in ref_rules:
+            if rule.bootstrap not in caches:
+                try:
+                    bootstrap = Commit(rule.bootstrap, project.repo)
+                    caches[rule.bootstrap] = project.find_cache(bootstrap)
+                except ValueError:
+                    caches[rule.bootstrap] = None
+            cache = caches[rule.bootstrap]
+            if cache and cache.get(head) is False:
+                return True
+        return False
+
+    status = {}
+    for ref, head in project.repo.references.items():
+        if ref == BARK_RULES_REF and project.bootstrap:
+            ref_rules = [bark_rules.get_bark_rules(project.bootstrap.hash)]
+        else:
+            ref_rules = [r for r in rules if r.pattern.match(ref)]
+        if not ref_rules:
+            continue
+
+        state = snapshot.get(ref)
+        if (
+            state
+            and state.tip == head.hash
+            and state.rules == get_ref_rules_fingerprint(modules, ref_rules, validator)
+        ):
+            status[ref] = (head, RefStatus.VALID if state.valid else RefStatus.INVALID)
+        elif is_invalid(head, ref_rules):
+            status[ref] = (head, RefStatus.INVALID)
+        else:
+            status[ref] = (head, RefStatus.UNKNOWN)
+    return status
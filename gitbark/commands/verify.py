@@ -14,21 +14,63 @@
 
 from ..core import (
     validate_commit_rules,
+    validate_heads_commit_rules,
+    stream_heads_commit_rules,
     validate_ref_rules,
     get_bark_rules,
+    get_bark_rules_commit,
+    get_rules_fingerprint,
     BARK_RULES_REF,
     BARK_REQUIREMENTS,
 )
 from ..objects import BarkRules, RefRuleData
-from ..git import Commit
-from ..rule import RuleViolation
-from ..project import Project
+from ..git import Commit, limit_object_cache
+from ..rule import RuleViolation, fail_fast_rules
+from ..project import Project, RefState, STREAM_MEMORY_CONFIG, FAIL_FAST_CONFIG
+from ..cache import Cache
+from ..env import get_requirements_hash
 from ..cli.util import CliFail
+from .prefilter import read_ref_prefilter, write_ref_prefilter
 
+from typing import Callable, Iterable, Optional
+import contextlib
+import hashlib
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Memory used to cache git objects when streaming, in MiB
+DEFAULT_STREAM_MEMORY_LIMIT = 64
+
+
+def _plan_installs(cache: Cache, head: Commit, bootstrap: Commit) -> list[bytes]:
+    """Collect the distinct requirements needed to validate bark_rules.
+
+    These are the requirements of the valid commits validating the commits not
+    yet cached. Requirements of commits which are not yet validated can't be
+    trusted, so they are only installed once the commit passes validation.
+    """
+    if cache.has(head):
+        return []
+    requirements = {}
+    seen = set()
+    to_visit = [head]
+    while to_visit:
+        commit = to_visit.pop()
+        if commit in seen:
+            continue
+        seen.add(commit)
+        if commit == bootstrap or cache.get(commit):
+            try:
+                content = commit.read_file(BARK_REQUIREMENTS)
+                requirements[get_requirements_hash(content)] = content
+            except FileNotFoundError:
+                pass
+        elif not cache.has(commit):
+            to_visit.extend(commit.parents)
+    return list(requirements.values())
+
 
 def verify_bark_rules(project: Project) -> BarkRules:
     """Verifies the bark_rules branch."""
@@ -43,11 +85,17 @@ def verify_bark_rules(project: Project) -> BarkRules:
         project.install_modules(requirements)
 
     cache = project.get_cache(bootstrap)
+    # Create all the envs needed up front, so they can be created in parallel
+    project.prepare_modules(_plan_installs(cache, head, bootstrap))
     validate_commit_rules(cache, head, bootstrap, on_valid)
 
     bark_rules = get_bark_rules(project)
     rule_data = bark_rules.get_bark_rules(bootstrap.hash).rule_data
     validate_ref_rules(cache, head, BARK_RULES_REF, rule_data)
+
+    # Keep the hook's prefilter in sync with the verified bark_rules
+    if read_ref_prefilter(project) != head.hash:
+        write_ref_prefilter(project, head, bark_rules)
     return bark_rules
 
 
@@ -64,57 +112,173 @@ def verify_commit(project: Project, commit: Commit, bootstrap: Commit):
     )
 
 
+# Gets the verified bark rules of a project
+RulesVerifier = Callable[[Project], BarkRules]
+
+
 def verify_ref(
     project: Project,
     ref: str,
     head: Commit,
+    verify_rules: RulesVerifier = verify_bark_rules,
+    stream: bool = False,
 ) -> None:
     """Verifies a ref.
 
     The head should be the current target of the ref.
     Uses bark_rules to find matching (commit and ref) rules for the given ref.
+    If stream is set, commits are validated using bounded memory.
     """
     if ref == BARK_RULES_REF and project.bootstrap:
         # Validate bark_rules branch
         rules = [get_bark_rules(project).get_bark_rules(project.bootstrap.hash)]
     else:
-        bark_rules = verify_bark_rules(project)
+        bark_rules = verify_rules(project)
         rules = bark_rules.get_ref_rules(ref)
 
     if not rules:
         raise RuleViolation(f"No rules defined for {ref}")
 
-    _do_verify_ref(
-        project=project,
-        ref=ref,
-        head=head,
-        rules=rules,
+    fingerprint = get_ref_rules_fingerprint(
+        get_rules_fingerprint(project), rules, get_bark_rules_commit(project)
     )
+    validated = None
+    if stream:
+        validated = _validate_commit_rules(project, [(head, rules)], stream)
+    try:
+        _do_verify_ref(
+            project=project,
+            ref=ref,
+            head=head,
+            rules=rules,
+            validated=validated,
+        )
+    except RuleViolation:
+        project.record_ref_states({ref: RefState(head.hash, fingerprint, False)})
+        raise
+    project.record_ref_states({ref: RefState(head.hash, fingerprint, True)})
+
 
+def get_ref_rules_fingerprint(
+    modules: bytes, rules: list[RefRuleData], validator: Optional[Commit]
+) -> bytes:
+    """Fingerprint of the rules a ref is verified with.
 
-def verify_all(project: Project):
-    """Verify all branches with matching ref rules."""
+    The modules fingerprint identifies the rule implementations, see
+    get_rules_fingerprint. The validator is the bark_rules head, which ref
+    rules are loaded from, and which may hold files they read.
+    """
+    h = hashlib.sha256(modules)
+    h.update(validator.hash if validator else b"")
+    for rule in rules:
+        h.update(rule.bootstrap)
+        h.update(repr(rule.rule_data).encode())
+    return h.digest()
+
+
+def _get_stream_memory_limit(project: Project) -> int:
+    """Get the memory used to cache git objects when streaming, in bytes."""
+    limit = project.repo.get_config(STREAM_MEMORY_CONFIG)
+    try:
+        size = int(limit) if limit else DEFAULT_STREAM_MEMORY_LIMIT
+    except ValueError:
+        raise CliFail(f"Invalid value for {STREAM_MEMORY_CONFIG}: {limit}")
+    return size * 1024 * 1024
+
+
+def _validate_commit_rules(
+    project: Project,
+    ref_heads: Iterable[tuple[Commit, list[RefRuleData]]],
+    stream: bool = False,
+) -> dict[tuple[bytes, Commit], Optional[RuleViolation]]:
+    """Validates the commit rules for several heads, grouped by bootstrap.
+
+    Each commit is validated once for each bootstrap, even if it is reachable
+    from several heads. If stream is set, commits are validated using bounded
+    memory. Returns violations keyed by bootstrap and head.
+    """
+    memory_limit = _get_stream_memory_limit(project) if stream else 0
+    heads: dict[bytes, set[Commit]] = {}
+    for head, rules in ref_heads:
+        for rule in rules:
+            heads.setdefault(rule.bootstrap, set()).add(head)
+
+    validated = {}
+    for bootstrap_hash, bootstrap_heads in heads.items():
+        bootstrap = Commit(bootstrap_hash, project.repo)
+        cache = project.get_cache(bootstrap)
+        checkpoints = project.get_checkpoints(bootstrap)
+        if stream:
+            with limit_object_cache(memory_limit):
+                results = stream_heads_commit_rules(
+                    cache, bootstrap_heads, bootstrap, checkpoints
+                )
+        else:
+            results = validate_heads_commit_rules(
+                cache, bootstrap_heads, bootstrap, checkpoints
+            )
+        for head, violation in results.items():
+            validated[(bootstrap_hash, head)] = violation
+        project.add_checkpoints(
+            bootstrap, [head for head, violation in results.items() if not violation]
+        )
+    return validated
+
+
+def verify_all(
+    project: Project,
+    changed: bool = False,
+    stream: bool = False,
+    fail_fast: bool = False,
+):
+    """Verify all branches with matching ref rules.
+
+    If changed is set, refs which were valid when last verified are skipped,
+    unless their target or rules have changed since. If stream is set, commits
+    are validated using bounded memory. If fail_fast is set, verification
+    stops at the first invalid ref.
+    """
     bark_rules = verify_bark_rules(project)
+    modules = get_rules_fingerprint(project)
+    validator = get_bark_rules_commit(project)
+    snapshot = project.get_ref_states()
 
-    violations = []
     rules = bark_rules.get_ref_rules()
+    states = {}
+    fingerprints = {}
+    ref_heads = {}
     for ref, head in project.repo.references.items():
-        try:
-            _do_verify_ref(
-                project=project,
-                ref=ref,
-                head=head,
-                rules=[r for r in rules if r.pattern.match(ref)],
-            )
-        except RuleViolation as e:
-            violations.append(e)
+        ref_rules = [r for r in rules if r.pattern.match(ref)]
+        if ref_rules:
+            fingerprints[ref] = get_ref_rules_fingerprint(modules, ref_rules, validator)
+            state = RefState(head.hash, fingerprints[ref], True)
+            if changed and snapshot.get(ref) == state:
+                logger.debug(f"Skipping unchanged ref: {ref}")
+                states[ref] = state
+                continue
+        ref_heads[ref] = (head, ref_rules)
+    results = _verify_ref_heads(project, ref_heads, stream, fail_fast)
+
+    for ref, violation in results.items():
+        if ref in fingerprints:
+            head = ref_heads[ref][0]
+            states[ref] = RefState(head.hash, fingerprints[ref], violation is None)
+    # Refs which no longer exist, or no longer have rules, are dropped, unless
+    # verification stopped early
+    project.record_ref_states(states, replace=len(results) == len(ref_heads))
 
+    violations = [v for v in results.values() if v]
     if violations:
         raise RuleViolation("Not all refs were valid", violations)
 
 
-def verify_ref_update(project: Project, ref: str, head: Commit):
-    bark_rules = verify_bark_rules(project)
+def verify_ref_update(
+    project: Project,
+    ref: str,
+    head: Commit,
+    verify_rules: RulesVerifier = verify_bark_rules,
+):
+    bark_rules = verify_rules(project)
     _do_verify_ref(
         project=project,
         ref=ref,
@@ -123,15 +287,302 @@ def verify_ref_update(project: Project, ref: str, head: Commit):
     )
 
 
+# A ref update reported by the reference-transaction hook, as (old, new, ref)
+RefUpdate = tuple[str, str, str]
+
+
+def _by_likely_failure(
+    project: Project, ref_heads: dict[str, tuple[Commit, list[RefRuleData]]]
+) -> list[str]:
+    """Order refs by how likely their verification is to fail.
+
+    Refs which were invalid when last verified come first, followed by refs
+    which have changed since, or were never verified. Refs without rules can't
+    fail, and come last.
+    """
+    snapshot = project.get_ref_states()
+
+    def priority(ref: str) -> int:
+        head, rules = ref_heads[ref]
+        state = snapshot.get(ref)
+        if not rules:
+            return 3
+        if state and not state.valid:
+            return 0
+        if not state or state.tip != head.hash:
+            return 1
+        return 2
+
+    return sorted(ref_heads, key=priority)
+
+
+def _verify_ref_heads(
+    project: Project,
+    ref_heads: dict[str, tuple[Commit, list[RefRuleData]]],
+    stream: bool = False,
+    fail_fast: bool = False,
+) -> dict[str, Optional[RuleViolation]]:
+    """Verifies several refs against their rules.
+
+    The commit rules of all heads are validated together. When failing fast,
+    refs are verified one at a time, those most likely to fail first, and
+    verification stops at the first violation. Returns the violation, if any,
+    of each verified ref.
+    """
+    if fail_fast:
+        order = _by_likely_failure(project, ref_heads)
+        validated = {}
+    else:
+        order = list(ref_heads)
+        validated = _validate_commit_rules(project, ref_heads.values(), stream)
+
+    results: dict[str, Optional[RuleViolation]] = {}
+    with fail_fast_rules() if fail_fast else contextlib.nullcontext():
+        for ref in order:
+            head, rules = ref_heads[ref]
+            if fail_fast:
+                validated.update(
+                    _validate_commit_rules(project, [(head, rules)], stream)
+                )
+            try:
+                _do_verify_ref(
+                    project=project,
+                    ref=ref,
+                    head=head,
+                    rules=rules,
+                    validated=validated,
+                )
+                results[ref] = None
+            except RuleViolation as e:
+                results[ref] = e
+                if fail_fast:
+                    logger.debug(f"{ref} is invalid, skipping remaining refs")
+                    break
+    return results
+
+
+def _find_invalid_commit(
+    project: Project, head: Commit, since: Commit, rules: list[RefRuleData]
+) -> Optional[RuleViolation]:
+    """Find a commit reachable from a valid head, but not from since, which is
+    itself invalid.
+
+    A head is valid if its nearest valid ancestors validate it, so this is
+    needed when one update adds several commits which were never verified on
+    their own. Returns the violation of the first invalid commit found.
+    """
+    for rule in rules:
+        bootstrap = Commit(rule.bootstrap, project.repo)
+        cache = project.get_cache(bootstrap)
+        for commit in project.repo.walk_new([head], [since]):
+            if cache.get(commit) is False:
+                try:
+                    validate_commit_rules(cache, commit, bootstrap)
+                except RuleViolation as e:
+                    return e
+    return None
+
+
+def _verify_targets(
+    project: Project,
+    targets: dict[str, bytes],
+    verify_rules: RulesVerifier,
+    since: Optional[dict[str, bytes]] = None,
+    record: bool = True,
+) -> dict[str, Optional[RuleViolation]]:
+    """Verifies new targets of several refs, as one batch.
+
+    bark_rules is verified once, and the commits of all targets are validated
+    together. If bark.failFast is set, verification stops at the first
+    violation. For refs in since, every commit added since the given commit
+    must be valid, not only the target. Unless record is False, the results are
+    recorded in the snapshot of verified refs, so targets must be given by
+    local ref names. Returns the violation, if any, of each verified ref.
+    """
+    try:
+        bark_rules = verify_rules(project)
+    except RuleViolation as e:
+        return {ref: e for ref in targets}
+
+    fail_fast = project.repo.get_config_bool(FAIL_FAST_CONFIG)
+    modules = get_rules_fingerprint(project)
+    validator = get_bark_rules_commit(project)
+    results: dict[str, Optional[RuleViolation]] = {}
+    ref_heads = {}
+    for ref, target in targets.items():
+        if ref == BARK_RULES_REF and project.bootstrap:
+            rules = [bark_rules.get_bark_rules(project.bootstrap.hash)]
+        else:
+            rules = bark_rules.get_ref_rules(ref)
+
+        try:
+            ref_heads[ref] = (Commit(target, project.repo), rules)
+        except ValueError:
+            results[ref] = (
+                RuleViolation(f"{target.hex()} is not a commit") if rules else None
+            )
+            if results[ref] and fail_fast:
+                return results
+    results.update(_verify_ref_heads(project, ref_heads, fail_fast=fail_fast))
+
+    for ref, old in (since or {}).items():
+        if ref in ref_heads and ref in results and results[ref] is None:
+            head, rules = ref_heads[ref]
+            try:
+                old_commit = Commit(old, project.repo)
+            except ValueError:
+                continue
+            results[ref] = _find_invalid_commit(project, head, old_commit, rules)
+
+    if not record:
+        return results
+    project.record_ref_states(
+        {
+            ref: RefState(
+                head.hash,
+                get_ref_rules_fingerprint(modules, rules, validator),
+                results[ref] is None,
+            )
+            for ref, (head, rules) in ref_heads.items()
+            if rules and ref in results
+        }
+    )
+    return results
+
+
+def verify_ref_updates(
+    project: Project,
+    updates: Iterable[RefUpdate],
+    verify_rules: RulesVerifier = verify_bark_rules,
+    all_commits: bool = False,
+) -> dict[str, Optional[RuleViolation]]:
+    """Verifies the ref updates of a transaction.
+
+    If all_commits is set, every commit between the old and new target of an
+    update must be valid, not only the new target. Returns the violation, if
+    any, of each updated ref which needs verification. The target of the first
+    rejected update is written to FAIL_HEAD.
+    """
+    references = project.repo.references
+    targets = {}
+    since = {}
+    for old, new, ref in updates:
+        if old == new or ref not in references:
+            # Not a change of a "real" ref
+            continue
+        if new == "00" * 20:
+            # Ref deletion
+            continue
+        targets[ref] = bytes.fromhex(new)
+        if all_commits and old != "00" * 20:
+            since[ref] = bytes.fromhex(old)
+
+    if not targets:
+        return {}
+    results = _verify_targets(project, targets, verify_rules, since)
+
+    fail_head = os.path.join(project.worktree_directory, "FAIL_HEAD")
+    rejected = [ref for ref, violation in results.items() if violation]
+    if rejected:
+        with open(fail_head, "w") as f:
+            f.write(targets[rejected[0]].hex())
+    elif os.path.exists(fail_head):
+        os.remove(fail_head)
+    return results
+
+
+def verify_received_refs(
+    project: Project,
+    updates: Iterable[RefUpdate],
+    verify_rules: RulesVerifier = verify_bark_rules,
+) -> dict[str, Optional[RuleViolation]]:
+    """Verifies the ref updates of a push, reported by the pre-receive hook.
+
+    Unlike in a transaction, refs created by the push are verified as well.
+    Returns the violation, if any, of each updated ref.
+    """
+    targets = {
+        ref: bytes.fromhex(new)
+        for old, new, ref in updates
+        if old != new and new != "00" * 20
+    }
+    if not targets:
+        return {}
+    return _verify_targets(project, targets, verify_rules)
+
+
+def verify_pushed_refs(
+    project: Project,
+    updates: Iterable[tuple[str, str, str, str]],
+    verify_rules: RulesVerifier = verify_bark_rules,
+) -> dict[str, Optional[RuleViolation]]:
+    """Verifies the refs of a push, reported by the pre-push hook.
+
+    Updates are given as (local ref, local hash, remote ref, remote hash). Each
+    pushed commit is verified with the rules of the remote ref it updates, and
+    commits already cached as valid, such as those already on the remote, are
+    not validated again. The results are not recorded in the snapshot of
+    verified refs, as they are for remote refs. Returns the violation, if any,
+    of each remote ref.
+    """
+    targets = {
+        remote_ref: bytes.fromhex(local_hash)
+        for _, local_hash, remote_ref, remote_hash in updates
+        if local_hash != remote_hash and local_hash != "00" * 20
+    }
+    if not targets:
+        return {}
+    return _verify_targets(project, targets, verify_rules, record=False)
+
+
+def verify_ref_transaction(
+    project: Project,
+    updates: Iterable[RefUpdate],
+    verify_rules: RulesVerifier = verify_bark_rules,
+    all_commits: bool = False,
+) -> bool:
+    """Verifies the ref updates reported by the reference-transaction hook.
+
+    Returns False if no update needs verification. A single violation is
+    raised if any update is rejected, rejecting the whole transaction.
+    """
+    results = verify_ref_updates(project, updates, verify_rules, all_commits)
+    violations = [v for v in results.values() if v]
+    if len(violations) == 1:
+        raise violations[0]
+    if violations:
+        raise RuleViolation("Not all refs were valid", violations)
+    for ref in results:
+        # TODO: Need to enable logging through env variable
+        logger.info(f"{ref} is valid")
+    return bool(results)
+
+
 def _do_verify_ref(
     project: Project,
     ref: str,
     head: Commit,
     rules: list[RefRuleData],
+    validated: Optional[dict[tuple[bytes, Commit], Optional[RuleViolation]]] = None,
 ) -> None:
+    """Verifies a ref against its rules.
+
+    Commit rule results are recorded in validated, if given, keyed by bootstrap
+    and head, so that refs sharing a target only validate it once.
+    """
     logger.debug(f"Verifying ref: {ref}")
+    validated = {} if validated is None else validated
     for rule in rules:
         bootstrap = Commit(rule.bootstrap, project.repo)
         cache = project.get_cache(bootstrap)
-        validate_commit_rules(cache, head, bootstrap)
+        key = (rule.bootstrap, head)
+        if key not in validated:
+            try:
+                validate_commit_rules(cache, head, bootstrap)
+                validated[key] = None
+            except RuleViolation as e:
+                validated[key] = e
+        violation = validated[key]
+        if violation:
+            raise violation
         validate_ref_rules(cache, head, ref, rule.rule_data)
@@ -16,7 +16,8 @@ from .git import Commit, BARK_CONFIG, is_descendant, BRANCH_REF_PREFIX
 from .project import Cache, Project
 from .rule import RuleViolation, CommitRule, AllCommitRule, RefRule
 from .objects import BarkRules, RuleData
-from typing import Callable, Optional
+from typing import Callable, Iterable, Optional
+import hashlib
 import yaml
 import logging
 
@@ -35,13 +36,19 @@ def _get_commit_rule(commit: Commit, cache: Cache) -> CommitRule:
 
 def _nearest_valid_ancestors(commit: Commit, cache: Cache) -> set[Commit]:
     """Return the nearest valid ancestors"""
-    parents = commit.parents
     valid_ancestors = set()
-    for parent in parents:
+    seen = set()
+    # Iterative, as chains of invalid commits may be long
+    to_visit = list(commit.parents)
+    while to_visit:
+        parent = to_visit.pop()
+        if parent in seen:
+            continue
+        seen.add(parent)
         if cache.get(parent):
             valid_ancestors.add(parent)
         else:
-            valid_ancestors.update(_nearest_valid_ancestors(parent, cache))
+            to_visit.extend(parent.parents)
     return valid_ancestors
 
 
@@ -141,11 +148,227 @@ def validate_commit_rules(
         raise RuleViolation(error_message, [e])
 
 
+def _walk_uncached(
+    cache: Cache, heads: list[Commit], bootstrap: Commit
+) -> list[Commit]:
+    """List the commits not yet cached reachable from heads, parents first."""
+    order: list[Commit] = []
+    seen: set[Commit] = set()
+    stack = [(head, False) for head in heads]
+    while stack:
+        commit, expanded = stack.pop()
+        if expanded:
+            order.append(commit)
+        elif commit not in seen and not cache.has(commit):
+            seen.add(commit)
+            stack.append((commit, True))
+            if commit != bootstrap:
+                stack.extend((p, False) for p in commit.parents if p not in seen)
+    return order
+
+
+def _walk_from_checkpoints(
+    cache: Cache, heads: list[Commit], bootstrap: Commit, checkpoints: Iterable[Commit]
+) -> Optional[list[Commit]]:
+    """List the commits not yet cached reachable from heads, parents first.
+
+    Commits reachable from a checkpoint are skipped without being looked up.
+    Returns None if no checkpoint can be used, if a head is reachable from a
+    checkpoint, or if the cache no longer holds the commits where the walk
+    stopped.
+    """
+    # Only trust checkpoints still cached as valid
+    known = [c for c in checkpoints if cache.get(c)]
+    if not known or not heads:
+        return None
+
+    walk = bootstrap.repo.walk_new(heads, known + bootstrap.parents)
+    order = [c for c in walk if not cache.has(c)]
+    listed = set(order)
+    # A head being re-validated may be an ancestor of a checkpoint
+    if not listed.issuperset(heads):
+        return None
+    for commit in order:
+        if commit != bootstrap and any(
+            p not in listed and not cache.has(p) for p in commit.parents
+        ):
+            return None
+    return order
+
+
+def _heads_to_validate(
+    cache: Cache,
+    heads: set[Commit],
+    bootstrap: Commit,
+    violations: dict[Commit, RuleViolation],
+) -> list[Commit]:
+    """Get the heads which need validation, recording those which can't pass."""
+    to_walk = []
+    for head in heads:
+        if head == bootstrap:
+            continue
+        if not bootstrap.repo.descendant_of(head, bootstrap):
+            violations[head] = RuleViolation(
+                f"Bootstrap '{bootstrap.hash.hex()}' is not an ancestor"
+            )
+            continue
+        valid = cache.get(head)
+        if valid is False:
+            # Re-validate if previously invalid
+            cache.remove(head)
+        if not valid:
+            to_walk.append(head)
+    return to_walk
+
+
+def _validate_next(
+    cache: Cache,
+    commit: Commit,
+    bootstrap: Commit,
+    heads: set[Commit],
+    violations: dict[Commit, RuleViolation],
+) -> None:
+    """Validate a commit, once its parents have been validated.
+
+    Only the violations of heads are recorded, other results are only cached.
+    """
+    if commit == bootstrap:
+        cache.set(commit, True)
+        return
+    try:
+        _validate_rules(commit, cache)
+        cache.set(commit, True)
+    except RuleViolation as e:
+        if commit in heads:
+            violations[commit] = e
+        cache.set(commit, False)
+
+
+def _head_results(
+    heads: set[Commit], violations: dict[Commit, RuleViolation]
+) -> dict[Commit, Optional[RuleViolation]]:
+    return {
+        head: (
+            RuleViolation(f"Validation errors for commit '{head}'", [violations[head]])
+            if head in violations
+            else None
+        )
+        for head in heads
+    }
+
+
+def validate_heads_commit_rules(
+    cache: Cache,
+    heads: Iterable[Commit],
+    bootstrap: Commit,
+    checkpoints: Iterable[Commit] = (),
+) -> dict[Commit, Optional[RuleViolation]]:
+    """Validates commit rules for several heads sharing a bootstrap.
+
+    The commits reachable from any of the heads which are not yet cached are
+    collected first, and then validated once each, parents before children.
+    Checkpoints are verified commits, which the walk stops at without looking
+    up each commit in the cache. Returns the violation, if any, of each head.
+    """
+    heads = set(heads)
+    violations: dict[Commit, RuleViolation] = {}
+    to_walk = _heads_to_validate(cache, heads, bootstrap, violations)
+
+    # Order the union of unvalidated commits, parents first
+    order = _walk_from_checkpoints(cache, to_walk, bootstrap, checkpoints)
+    if order is None:
+        order = _walk_uncached(cache, to_walk, bootstrap)
+
+    for commit in order:
+        _validate_next(cache, commit, bootstrap, heads, violations)
+    return _head_results(heads, violations)
+
+
+# Number of commits validated between writes to the cache, when streaming
+STREAM_CHUNK_SIZE = 1000
+
+
+def _validate_stream(
+    cache: Cache,
+    to_walk: list[Commit],
+    bootstrap: Commit,
+    known: list[Commit],
+    heads: set[Commit],
+    violations: dict[Commit, RuleViolation],
+    chunk_size: int,
+) -> bool:
+    """Validate the commits reachable from to_walk but not from known.
+
+    Returns False if a commit is reached whose parent was skipped, but is not
+    cached, or if a head in to_walk is reachable from known.
+    """
+    count = 0
+    unreached = set(to_walk)
+    for commit in bootstrap.repo.stream_new(to_walk, known + bootstrap.parents):
+        unreached.discard(commit)
+        if cache.has(commit):
+            continue
+        if commit != bootstrap and any(
+            not cache.has(p) and p not in bootstrap.parents for p in commit.parents
+        ):
+            return False
+        _validate_next(cache, commit, bootstrap, heads, violations)
+        count += 1
+        if count % chunk_size == 0:
+            cache.flush()
+    cache.flush()
+    return not unreached
+
+
+def stream_heads_commit_rules(
+    cache: Cache,
+    heads: Iterable[Commit],
+    bootstrap: Commit,
+    checkpoints: Iterable[Commit] = (),
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> dict[Commit, Optional[RuleViolation]]:
+    """Validates commit rules for several heads, using bounded memory.
+
+    Like validate_heads_commit_rules, but the commits to validate are streamed
+    in topological order instead of being collected first, and results are
+    written to the cache every chunk_size commits. Memory use does not grow
+    with the number of commits validated.
+    """
+    heads = set(heads)
+    violations: dict[Commit, RuleViolation] = {}
+    to_walk = _heads_to_validate(cache, heads, bootstrap, violations)
+    if to_walk:
+        # Only trust checkpoints still cached as valid
+        known = [c for c in checkpoints if cache.get(c)]
+        if not _validate_stream(
+            cache, to_walk, bootstrap, known, heads, violations, chunk_size
+        ):
+            # Walk the full history instead of stopping at the checkpoints
+            _validate_stream(
+                cache, to_walk, bootstrap, [], heads, violations, chunk_size
+            )
+    return _head_results(heads, violations)
+
+
 def get_bark_rules_commit(project: Project) -> Optional[Commit]:
     """Gets the latest commit on bark_rules."""
     return project.repo.references.get(BARK_RULES_REF)
 
 
+def get_rules_fingerprint(project: Project) -> bytes:
+    """Fingerprint of the rule implementations used for validation.
+
+    This is derived from the bark modules required by the latest bark_rules,
+    and changes whenever a different set of modules is installed.
+    """
+    commit = get_bark_rules_commit(project)
+    try:
+        requirements = commit.read_file(BARK_REQUIREMENTS) if commit else b""
+    except FileNotFoundError:
+        requirements = b""
+    return hashlib.sha256(requirements).digest()
+
+
 def get_bark_rules(project: Project, commit: Optional[Commit] = None) -> BarkRules:
     """Returns the latest bark_rules"""
 
@@ -0,0 +1,322 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .util import cmd
+
+from typing import Any, Iterable, Iterator, Optional
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from importlib.metadata import distributions
+import os
+import re
+import sys
+import json
+import fcntl
+import shutil
+import hashlib
+import platform
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Written to an env once its modules are installed
+ENV_METADATA = "bark-env.json"
+# Lists the repositories using an env store
+REPOSITORIES_FILE = "repositories"
+# Prefetched wheels, in one directory per requirements hash
+WHEELHOUSE_DIRECTORY = "wheelhouse"
+# Maximum number of envs created in parallel
+MAX_WORKERS = 4
+
+_ENV_NAME = re.compile(r"[0-9a-f]{64}")
+# A requirement given only by name, optionally pinned to a version
+_SIMPLE_REQUIREMENT = re.compile(r"([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:==\s*(\S+))?")
+
+
+def get_requirements_hash(requirements: bytes) -> str:
+    return hashlib.sha256(requirements).hexdigest()
+
+
+def load_env(path: str) -> Optional[dict[str, Any]]:
+    """Load the metadata of an env, if it is complete and usable."""
+    try:
+        with open(os.path.join(path, ENV_METADATA), "r") as f:
+            metadata = json.load(f)
+        cfg_mtime = os.stat(os.path.join(path, "pyvenv.cfg")).st_mtime_ns
+    except (OSError, ValueError):
+        return None
+
+    if (
+        metadata.get("path") != path
+        or metadata.get("pyvenv_mtime") != cfg_mtime
+        or metadata.get("python_version") != platform.python_version()
+        or not os.path.exists(metadata.get("python", ""))
+    ):
+        logger.debug(f"The env metadata in {path} is out of date")
+        return None
+    return metadata
+
+
+def _normalize_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _get_installed(paths: list[str]) -> dict[str, str]:
+    """Get the versions of the distributions installed in paths, by name."""
+    return {
+        _normalize_name(d.metadata["Name"]): d.version
+        for d in distributions(path=paths)
+    }
+
+
+def _get_pins(requirements: bytes) -> Optional[dict[str, Optional[str]]]:
+    """Get the pinned version of each requirement, by name.
+
+    Requirements given only by name are mapped to None. Returns None if any
+    requirement is more complex than a name, optionally pinned with ==.
+    """
+    pins: dict[str, Optional[str]] = {}
+    for line in requirements.decode().splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        m = _SIMPLE_REQUIREMENT.fullmatch(line)
+        if not m:
+            return None
+        pins[_normalize_name(m.group(1))] = m.group(2)
+    return pins
+
+
+def _is_satisfied(requirements: bytes, paths: list[str]) -> bool:
+    """Check if requirements are already installed in paths, without pip.
+
+    Only requirements given by name, optionally pinned with ==, are checked.
+    Any other requirement is assumed not to be satisfied.
+    """
+    pins = _get_pins(requirements)
+    if pins is None:
+        return False
+    installed = _get_installed(paths) if pins else {}
+    for name, pin in pins.items():
+        version = installed.get(name)
+        if version is None or pin not in (None, version):
+            return False
+    return True
+
+
+def _install_wheels(
+    exec_path: str, wheels: str, requirements: bytes, paths: list[str]
+) -> None:
+    """Install prefetched wheels, without accessing a package index.
+
+    A wheel is skipped if the version in its filename is already installed, and
+    does not conflict with a version pinned by the requirements.
+    """
+    installed = _get_installed(paths)
+    pins = _get_pins(requirements) or {}
+    files = []
+    for f in sorted(os.listdir(wheels)):
+        if not f.endswith(".whl"):
+            continue
+        name, version = f.split("-")[:2]
+        name = _normalize_name(name)
+        if installed.get(name) == version and pins.get(name) in (None, version):
+            continue
+        files.append(os.path.join(wheels, f))
+    if files:
+        logger.debug(f"Installing modules from {wheels}")
+        cmd(
+            exec_path,
+            "-m",
+            "pip",
+            "install",
+            "--no-index",
+            "--find-links",
+            wheels,
+            *files,
+        )
+
+
+def _create_env(
+    path: str, requirements: bytes, wheels: Optional[str] = None
+) -> dict[str, Any]:
+    # Create venv
+    cmd(sys.executable, "-m", "venv", "--clear", path)
+
+    # Add additional site-packages
+    exec_path = os.path.join(path, "bin", "python")
+    env_path, env_site = cmd(
+        exec_path,
+        "-c",
+        "import sys, sysconfig; print(':'.join(sys.path)); "
+        "print(sysconfig.get_paths()['purelib'])",
+    )[0].splitlines()
+    additional = [p for p in sys.path[1:] if p not in env_path.split(":")]
+    with open(os.path.join(env_site, "gitbark.pth"), "w") as f:
+        f.write("\n".join(additional))
+
+    r_file = os.path.join(path, "requirements.txt")
+    with open(r_file, "wb") as f:
+        f.write(requirements)
+    if _is_satisfied(requirements, [env_site] + additional):
+        logger.debug(f"Modules for {path} are already installed")
+    elif wheels:
+        _install_wheels(exec_path, wheels, requirements, [env_site] + additional)
+    else:
+        logger.debug(f"Installing modules in {path}")
+        cmd(exec_path, "-m", "pip", "install", "-r", r_file)
+
+    metadata = {
+        "path": path,
+        "python": exec_path,
+        "site_packages": env_site,
+        "python_version": platform.python_version(),
+        "pyvenv_mtime": os.stat(os.path.join(path, "pyvenv.cfg")).st_mtime_ns,
+        "requirements_hash": get_requirements_hash(requirements),
+    }
+    with open(os.path.join(path, ENV_METADATA), "w") as f:
+        json.dump(metadata, f)
+    return metadata
+
+
+class EnvStore:
+    """A directory of envs for bark modules, keyed by requirements hash.
+
+    A store can be shared by several repositories, which register themselves
+    when they use it. Envs are installed from the wheelhouse when their
+    requirements have been prefetched, without accessing a package index.
+    """
+
+    def __init__(self, path: str, wheelhouse: Optional[str] = None) -> None:
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.wheelhouse = os.path.abspath(
+            wheelhouse or os.path.join(self.path, WHEELHOUSE_DIRECTORY)
+        )
+
+    def get_wheels(self, requirements_hash: str) -> Optional[str]:
+        """Get the directory of prefetched wheels for requirements, if any."""
+        path = os.path.join(self.wheelhouse, requirements_hash)
+        return path if os.path.isdir(path) else None
+
+    def prefetch(self, requirements: bytes) -> bool:
+        """Download and build the wheels for requirements into the wheelhouse.
+
+        Returns False if they were already prefetched.
+        """
+        requirements_hash = get_requirements_hash(requirements)
+        if self.get_wheels(requirements_hash):
+            return False
+        os.makedirs(self.wheelhouse, exist_ok=True)
+        path = os.path.join(self.wheelhouse, requirements_hash)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        r_file = os.path.join(tmp_path, "requirements.txt")
+        with open(r_file, "wb") as f:
+            f.write(requirements)
+        logger.debug(f"Prefetching wheels into {path}")
+        cmd(sys.executable, "-m", "pip", "wheel", "-r", r_file, "-w", tmp_path)
+        # Only complete downloads are renamed into place
+        os.replace(tmp_path, path)
+        return True
+
+    @contextmanager
+    def _lock(
+        self, requirements_hash: str, blocking: bool = True, remove: bool = False
+    ) -> Iterator[bool]:
+        """Lock an env, yielding False if not blocking and it is in use.
+
+        If remove is set, the lock file is removed before it is unlocked.
+        """
+        path = os.path.join(self.path, f"{requirements_hash}.lock")
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            with open(path, "w") as f:
+                try:
+                    fcntl.flock(f, flags)
+                except BlockingIOError:
+                    yield False
+                    return
+                # The lock file may have been removed while waiting for it
+                try:
+                    if not os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                        continue
+                except FileNotFoundError:
+                    continue
+                try:
+                    yield True
+                finally:
+                    if remove:
+                        os.remove(path)
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                return
+
+    def get_env(self, requirements: bytes) -> dict[str, Any]:
+        """Get the env for a set of requirements, creating it if needed."""
+        requirements_hash = get_requirements_hash(requirements)
+        path = os.path.join(self.path, requirements_hash)
+        # Fast path, without locking
+        env = load_env(path)
+        if env:
+            return env
+        with self._lock(requirements_hash):
+            # The env may have been created while waiting for the lock
+            return load_env(path) or _create_env(
+                path, requirements, self.get_wheels(requirements_hash)
+            )
+
+    def prepare_envs(self, requirement_sets: Iterable[bytes]) -> None:
+        """Create the envs for several sets of requirements, in parallel."""
+        missing = {
+            get_requirements_hash(r): r
+            for r in requirement_sets
+            if not load_env(os.path.join(self.path, get_requirements_hash(r)))
+        }
+        if missing:
+            logger.debug(f"Creating {len(missing)} envs")
+            with ThreadPoolExecutor(min(len(missing), MAX_WORKERS)) as executor:
+                # Consume the results, to raise any error
+                list(executor.map(self.get_env, missing.values()))
+
+    def envs(self) -> list[str]:
+        """List the requirements hashes of the envs in the store."""
+        return [
+            name
+            for name in os.listdir(self.path)
+            if _ENV_NAME.fullmatch(name)
+            and os.path.isdir(os.path.join(self.path, name))
+        ]
+
+    def remove_env(self, requirements_hash: str) -> bool:
+        """Remove an env, unless it is being created."""
+        with self._lock(requirements_hash, blocking=False, remove=True) as locked:
+            if not locked:
+                return False
+            shutil.rmtree(os.path.join(self.path, requirements_hash))
+        return True
+
+    def register(self, repository: str) -> None:
+        """Record that a repository uses the store."""
+        repository = os.path.abspath(repository)
+        if repository not in self.repositories():
+            with open(os.path.join(self.path, REPOSITORIES_FILE), "a") as f:
+                f.write(f"{repository}\n")
+
+    def repositories(self) -> list[str]:
+        try:
+            with open(os.path.join(self.path, REPOSITORIES_FILE), "r") as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
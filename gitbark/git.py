@@ -15,9 +15,22 @@
 from .objects import RuleData
 from .util import cmd
 
-from pygit2 import Commit as _Commit, Tree, Repository as _Repository, Tag as _Tag
-from typing import Union, Tuple, Optional
+from pygit2 import (
+    Commit as _Commit,
+    Tree,
+    Repository as _Repository,
+    Tag as _Tag,
+    GIT_FILEMODE_BLOB,
+    GIT_FILEMODE_TREE,
+    GIT_SORT_TOPOLOGICAL,
+    GIT_SORT_REVERSE,
+    settings,
+)
+from typing import Any, Iterable, Iterator, Union, Tuple, Optional
+from contextlib import contextmanager
+import subprocess
 import yaml
+import os
 import re
 
 BRANCH_REF_PREFIX = "refs/heads/"
@@ -85,6 +98,11 @@ class Commit:
     def tree_hash(self) -> bytes:
         return self._object.tree_id.raw
 
+    @property
+    def commit_time(self) -> int:
+        """The committer timestamp, in seconds since the epoch."""
+        return self._object.commit_time
+
     @property
     def author(self) -> tuple[str, str]:
         """A tuple with the author name and email."""
@@ -104,6 +122,7 @@ class Commit:
             "--decorate=full",
             "--abbrev-commit",
             self.hash.hex(),
+            cwd=self.repo._path,
         )[0]
 
     @property
@@ -183,11 +202,35 @@ class Repository:
     def __init__(self, path: str) -> None:
         self._object = _Repository(path)
         self._path = path
+        # Objects received by a push are kept in a quarantine directory until
+        # the pre-receive hook accepts them
+        quarantine = os.environ.get("GIT_QUARANTINE_PATH")
+        if quarantine:
+            self._object.odb.add_disk_alternate(quarantine)
 
     @property
     def head(self) -> Commit:
         return Commit(self._object.head.target.raw, self)
 
+    @property
+    def is_bare(self) -> bool:
+        return self._object.is_bare
+
+    @property
+    def git_dir(self) -> str:
+        """The git directory of the worktree."""
+        return os.path.normpath(self._object.path)
+
+    @property
+    def common_dir(self) -> str:
+        """The git directory shared by all worktrees of the repository."""
+        git_dir = self._object.path
+        try:
+            with open(os.path.join(git_dir, "commondir"), "r") as f:
+                return os.path.normpath(os.path.join(git_dir, f.read().strip()))
+        except FileNotFoundError:
+            return os.path.normpath(git_dir)
+
     @property
     def branch(self) -> Optional[str]:
         if self._object.head_is_unborn:
@@ -209,6 +252,111 @@ class Repository:
     def branches(self) -> list[str]:
         return list(self._object.branches.local)
 
+    def walk(self, head: Commit) -> Iterator[Commit]:
+        """Iterate over a commit and its ancestors, children first."""
+        for commit in self._object.walk(head.hash.hex(), GIT_SORT_TOPOLOGICAL):
+            yield Commit(commit.id.raw, self)
+
+    def walk_new(
+        self, heads: Iterable[Commit], known: Iterable[Commit]
+    ) -> Iterator[Commit]:
+        """Iterate over commits reachable from heads but not from known.
+
+        Parents are returned before their children.
+        """
+        walker = self._object.walk(None, GIT_SORT_TOPOLOGICAL | GIT_SORT_REVERSE)
+        for head in heads:
+            walker.push(head.hash.hex())
+        for commit in known:
+            walker.hide(commit.hash.hex())
+        for git_commit in walker:
+            yield Commit(git_commit.id.raw, self)
+
+    def stream_new(
+        self, heads: Iterable[Commit], known: Iterable[Commit]
+    ) -> Iterator[Commit]:
+        """Iterate over commits reachable from heads but not from known.
+
+        Parents are returned before their children. Unlike walk_new, the
+        commits are ordered by git in a separate process and read one at a
+        time, so memory use does not grow with the number of commits.
+        """
+        revs = [h.hash.hex() for h in heads] + [f"^{c.hash.hex()}" for c in known]
+        with subprocess.Popen(
+            ["git", "rev-list", "--topo-order", "--reverse", "--stdin"],
+            cwd=self._path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        ) as proc:
+            assert proc.stdin and proc.stdout
+            try:
+                proc.stdin.write("".join(f"{rev}\n" for rev in revs))
+                proc.stdin.close()
+                for line in proc.stdout:
+                    yield Commit(bytes.fromhex(line.strip()), self)
+                if proc.wait():
+                    raise subprocess.CalledProcessError(proc.returncode, proc.args)
+            finally:
+                # The caller may stop iterating early
+                if proc.poll() is None:
+                    proc.kill()
+
+    def descendant_of(self, commit: Commit, ancestor: Commit) -> bool:
+        """Check if a commit is a descendant of another, other than itself."""
+        return self._object.descendant_of(commit.hash.hex(), ancestor.hash.hex())
+
+    def get_config(self, name: str) -> Optional[str]:
+        """Read a value from the git config, or None if it is not set."""
+        try:
+            return self._object.config[name]
+        except KeyError:
+            return None
+
+    def get_config_bool(self, name: str) -> bool:
+        """Read a boolean from the git config, False if it is not set."""
+        try:
+            return self._object.config.get_bool(name)
+        except KeyError:
+            return False
+
+    def read_notes(self, ref: str) -> dict[bytes, str]:
+        """Read all notes under a notes ref, keyed by annotated commit hash."""
+        if ref not in self._object.references:
+            return {}
+        return {note.annotated_id.raw: note.message for note in self._object.notes(ref)}
+
+    def write_notes(
+        self, ref: str, notes: dict[bytes, str], message: str, sign: bool = False
+    ) -> None:
+        """Replace all notes under a notes ref, in a single commit."""
+        repo = self._object
+        fanout: dict[str, Any] = {}
+        for commit_hash, note in notes.items():
+            name = commit_hash.hex()
+            if name[:2] not in fanout:
+                fanout[name[:2]] = repo.TreeBuilder()
+            blob = repo.create_blob(note.encode())
+            fanout[name[:2]].insert(name[2:], blob, GIT_FILEMODE_BLOB)
+        root = repo.TreeBuilder()
+        for prefix, builder in fanout.items():
+            root.insert(prefix, builder.write(), GIT_FILEMODE_TREE)
+
+        parent = repo.references.get(ref)
+        args = ["-p", str(parent.target)] if parent else []
+        commit = cmd(
+            "git",
+            "commit-tree",
+            str(root.write()),
+            "-m",
+            message,
+            "-S" if sign else "--no-gpg-sign",
+            *args,
+            cwd=self._path,
+        )[0]
+        old = [str(parent.target)] if parent else []
+        cmd("git", "update-ref", ref, commit, *old, cwd=self._path)
+
     def resolve(self, name: str) -> Tuple[Commit, Optional[str]]:
         commit, ref = self._object.resolve_refish(name)
         return Commit(commit.id.raw, self), (
@@ -216,6 +364,17 @@ class Repository:
         )
 
 
+@contextmanager
+def limit_object_cache(max_size: int) -> Iterator[None]:
+    """Limit the memory used to cache git objects, in bytes, within a block."""
+    _, previous = settings.cached_memory
+    settings.cache_max_size(max_size)
+    try:
+        yield
+    finally:
+        settings.cache_max_size(previous)
+
+
 def is_descendant(prev: Commit, new: Commit) -> bool:
     """Checks that the current tip is a descendant of the old tip"""
 
@@ -226,6 +385,7 @@ def is_descendant(prev: Commit, new: Commit) -> bool:
         prev.hash.hex(),
         new.hash.hex(),
         check=False,
+        cwd=new.repo._path,
     )
 
     return exit_status == 0
@@ -12,15 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .util import cmd
 from .git import Commit, Repository, is_descendant
-from .cache import Cache
-
-from typing import Optional
+from .cache import Cache, CACHE_BACKENDS, open_cache, get_backend
+from .registry import registry
+from .env import EnvStore, load_env, get_requirements_hash
+from .util import atomic_write, file_lock
+
+from pygit2 import GitError
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
 from enum import Enum
 import os
 import sys
 import re
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,101 +34,362 @@ logger = logging.getLogger(__name__)
 class PROJECT_FILES(str, Enum):
     BOOTSTRAP = "bootstrap"
     CACHE = "cache"
+    ENV_METADATA = "env.json"
+    REGISTRY = "registry.json"
+    REF_PREFILTER = "ref_prefilter"
+    CHECKPOINTS = "checkpoints.json"
+    REF_SNAPSHOT = "ref_snapshot.json"
 
 
 BARK_DIRECTORY = "bark"
-ENV_DIRECTORY = "env"
+ENV_STORE_DIRECTORY = "envs"
 BARK_MODULES_DIRECTORY = "bark_modules"
 
-CACHE_NAME_PATTERN = re.compile(r"([0-9a-f]{40})\.db")
+CACHE_NAME_PATTERN = re.compile(r"([0-9a-f]{40})\.(db|log)$")
+CACHE_BACKEND_CONFIG = "bark.cacheBackend"
+ENV_STORE_CONFIG = "bark.envStore"
+WHEELHOUSE_CONFIG = "bark.wheelhouse"
+STREAM_MEMORY_CONFIG = "bark.streamMemoryLimit"
+FAIL_FAST_CONFIG = "bark.failFast"
+NOTES_TRUSTED_KEYS_CONFIG = "bark.notesTrustedKeys"
+NOTES_ALLOWED_SIGNERS_CONFIG = "bark.notesAllowedSigners"
+
+# Number of verified commits kept as checkpoints, per bootstrap
+MAX_CHECKPOINTS = 16
+
+
+@dataclass
+class RefState:
+    """The result of the last verification of a ref.
+
+    The rules fingerprint identifies the rules the tip was verified with.
+    """
+
+    tip: bytes
+    rules: bytes
+    valid: bool
+
+
+def get_bark_directory(repo: Repository) -> str:
+    """Get the bark directory of a repository, shared by all its worktrees."""
+    return os.path.join(repo.common_dir, BARK_DIRECTORY)
 
 
 class Project:
     def __init__(self, path: str) -> None:
         self.path = path
-        self.bark_directory = os.path.join(self.path, ".git", BARK_DIRECTORY)
-        self.env_path = os.path.join(self.bark_directory, ENV_DIRECTORY)
+        self.repo = Repository(self.path)
+        # Shared by all worktrees
+        self.bark_directory = get_bark_directory(self.repo)
         self.cache_directory = os.path.join(self.bark_directory, PROJECT_FILES.CACHE)
+        # State specific to the worktree, such as the active branch
+        self.worktree_directory = os.path.join(self.repo.git_dir, BARK_DIRECTORY)
 
         if not os.path.exists(self.bark_directory):
             os.makedirs(self.bark_directory, exist_ok=True)
 
-        if not os.path.exists(self.env_path):
-            self.create_env()
+        if not os.path.exists(self.worktree_directory):
+            os.makedirs(self.worktree_directory, exist_ok=True)
 
         if not os.path.exists(self.cache_directory):
             os.makedirs(self.cache_directory, exist_ok=True)
 
-        sys.path.append(self.get_env_site_packages())
+        # The env is selected when modules are first installed
+        self._env = self._load_env_metadata()
+        if self._env:
+            sys.path.append(self._env["site_packages"])
+        registry.configure(os.path.join(self.bark_directory, PROJECT_FILES.REGISTRY))
 
-        self.repo = Repository(self.path)
-        self._caches: dict[Commit, Cache] = {}
-        self._load_caches()
+        # Caches are discovered by filename, and opened on first use
+        self._cache_paths: dict[bytes, str] = {}
+        self._caches: dict[bytes, Cache] = {}
+        self._find_caches()
         self.bootstrap = self._load_bootstrap()
-
-    def _load_caches(self):
+        # Loaded on first use
+        self._checkpoints: Optional[dict[bytes, list[bytes]]] = None
+        self._checkpoints_changed: set[bytes] = set()
+        self._ref_states: Optional[dict[str, RefState]] = None
+        self._ref_states_changed: set[str] = set()
+        self._ref_states_replaced = False
+
+    def _find_caches(self) -> None:
         for fname in os.listdir(self.cache_directory):
             m = CACHE_NAME_PATTERN.match(fname)
             if m:
-                key = Commit(bytes.fromhex(m.group(1)), self.repo)
-                self._caches[key] = Cache(os.path.join(self.cache_directory, fname))
+                key = bytes.fromhex(m.group(1))
+                self._cache_paths[key] = os.path.join(self.cache_directory, fname)
+
+    def _open_cache(self, bootstrap: bytes) -> Cache:
+        if bootstrap not in self._caches:
+            self._caches[bootstrap] = open_cache(self._cache_paths[bootstrap])
+        return self._caches[bootstrap]
+
+    def find_cache(self, bootstrap: Commit) -> Optional[Cache]:
+        """Find the existing cache used for a bootstrap, if any."""
+        if bootstrap.hash in self._cache_paths:
+            return self._open_cache(bootstrap.hash)
+
+        for bs in self._cache_paths:
+            try:
+                bs_commit = Commit(bs, self.repo)
+            except ValueError:
+                continue  # Bootstrap no longer exists
+            if is_descendant(bs_commit, bootstrap):
+                cache = self._open_cache(bs)
+                if cache.get(bootstrap):
+                    return cache
+        return None
 
     def get_cache(self, bootstrap: Commit) -> Cache:
-        if bootstrap in self._caches:
-            return self._caches[bootstrap]
-
-        for bs, cache in self._caches.items():
-            if is_descendant(bs, bootstrap) and cache.get(bootstrap):
-                return cache
-
-        cache = Cache(os.path.join(self.cache_directory, f"{bootstrap.hash.hex()}.db"))
-        self._caches[bootstrap] = cache
+        cache = self.find_cache(bootstrap)
+        if cache:
+            return cache
+
+        backend = CACHE_BACKENDS[self.get_cache_backend()]
+        path = os.path.join(
+            self.cache_directory, f"{bootstrap.hash.hex()}{backend.extension}"
+        )
+        self._cache_paths[bootstrap.hash] = path
+        cache = self._caches[bootstrap.hash] = backend(path)
         return cache
 
+    def get_cache_backend(self) -> str:
+        """Get the name of the backend used for new caches."""
+        backend = self.repo.get_config(CACHE_BACKEND_CONFIG) or "sqlite"
+        if backend not in CACHE_BACKENDS:
+            raise ValueError(f"Unsupported cache backend: {backend}")
+        return backend
+
+    def get_caches(self) -> dict[bytes, Cache]:
+        """Open all caches, keyed by bootstrap hash."""
+        return {bs: self._open_cache(bs) for bs in list(self._cache_paths)}
+
+    def remove_cache(self, bootstrap: bytes) -> None:
+        """Close and delete the cache for a bootstrap."""
+        path = self._cache_paths.pop(bootstrap)
+        cache = self._caches.pop(bootstrap, None)
+        if cache:
+            cache.close()
+        if self._load_checkpoints().pop(bootstrap, None):
+            self._checkpoints_changed.add(bootstrap)
+        for f in get_backend(path).files(path):
+            if os.path.exists(f):
+                os.remove(f)
+
     @staticmethod
     def exists(path: str) -> bool:
-        bark_directory = os.path.join(path, ".git", BARK_DIRECTORY)
-        return os.path.exists(bark_directory)
-
-    def create_env(self) -> None:
-        # Create venv
-        os.makedirs(self.env_path, exist_ok=True)
-        cmd(sys.executable, "-m", "venv", self.env_path, cwd=self.path)
-
-        # Add additional site-packages
-        exec_path = os.path.join(self.env_path, "bin", "python")
-        env_path = cmd(exec_path, "-c", "import sys; print(':'.join(sys.path))")[
-            0
-        ].split(":")
-        additional = [p for p in sys.path[1:] if p not in env_path]
-        env_site = self.get_env_site_packages()
-        with open(os.path.join(env_site, "gitbark.pth"), "w") as f:
-            f.write("\n".join(additional))
+        try:
+            repo = Repository(path)
+        except GitError:
+            return False
+        return os.path.exists(get_bark_directory(repo))
+
+    def _load_env_metadata(self) -> Optional[dict[str, Any]]:
+        """Load the metadata of the selected env, if it is still usable."""
+        metadata_file = os.path.join(self.bark_directory, PROJECT_FILES.ENV_METADATA)
+        try:
+            with open(metadata_file, "r") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return load_env(metadata.get("path", ""))
+
+    def _save_env_metadata(self) -> None:
+        metadata_file = os.path.join(self.bark_directory, PROJECT_FILES.ENV_METADATA)
+        with atomic_write(metadata_file) as f:
+            json.dump(self._env, f)
+
+    def get_env_store(self) -> EnvStore:
+        """Get the store of envs, which may be shared with other repositories."""
+        path = self.repo.get_config(ENV_STORE_CONFIG)
+        wheelhouse = self.repo.get_config(WHEELHOUSE_CONFIG)
+        return EnvStore(
+            os.path.expanduser(path)
+            if path
+            else os.path.join(self.bark_directory, ENV_STORE_DIRECTORY),
+            os.path.expanduser(wheelhouse) if wheelhouse else None,
+        )
 
     def install_modules(self, requirements: bytes) -> None:
-        r_file = os.path.join(self.bark_directory, "requirements.txt")
-
-        if os.path.exists(r_file):
-            with open(r_file, "rb") as f:
-                old_reqs = f.read()
-        else:
-            old_reqs = b""
-
-        if requirements != old_reqs:
-            with open(r_file, "wb") as f:
-                f.write(requirements)
-
-            logger.debug("Installing modules")
-            pip_path = os.path.join(self.env_path, "bin", "pip")
-            cmd(pip_path, "install", "-r", r_file)
-
-    def get_env_site_packages(self) -> str:
-        exec_path = os.path.join(self.env_path, "bin", "python")
-        return cmd(
-            exec_path,
-            "-c",
-            "from sysconfig import get_paths; print(get_paths()['purelib'])",
-        )[0]
+        """Select the env for a set of requirements, installing it if needed."""
+        if self._env and self._env["requirements_hash"] == get_requirements_hash(
+            requirements
+        ):
+            return
+
+        store = self.get_env_store()
+        store.register(self.path)
+        env = store.get_env(requirements)
+        if self._env and self._env["site_packages"] in sys.path:
+            sys.path.remove(self._env["site_packages"])
+        sys.path.append(env["site_packages"])
+        registry.invalidate()
+        self._env = env
+        self._save_env_metadata()
+
+    def prepare_modules(self, requirement_sets: Iterable[bytes]) -> None:
+        """Create the envs for several sets of requirements, without selecting."""
+        store = self.get_env_store()
+        store.register(self.path)
+        store.prepare_envs(requirement_sets)
+
+    def get_env_site_packages(self) -> Optional[str]:
+        return self._env["site_packages"] if self._env else None
+
+    def _read_checkpoints(self) -> dict[bytes, list[bytes]]:
+        path = os.path.join(self.bark_directory, PROJECT_FILES.CHECKPOINTS)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            return {
+                bytes.fromhex(bs): [bytes.fromhex(c) for c in commits]
+                for bs, commits in data.items()
+            }
+        except (OSError, ValueError):
+            return {}
+
+    def _load_checkpoints(self) -> dict[bytes, list[bytes]]:
+        if self._checkpoints is None:
+            self._checkpoints = self._read_checkpoints()
+        return self._checkpoints
+
+    def _to_commits(self, hashes: Iterable[bytes]) -> list[Commit]:
+        commits = []
+        for commit_hash in hashes:
+            try:
+                commits.append(Commit(commit_hash, self.repo))
+            except ValueError:
+                continue  # Commit no longer exists
+        return commits
+
+    def get_checkpoints(self, bootstrap: Commit) -> list[Commit]:
+        """Get the checkpoints of a bootstrap.
+
+        Checkpoints are verified commits, such as ref tips. All of their
+        ancestors have been validated, so a walk can stop at them.
+        """
+        return self._to_commits(self._load_checkpoints().get(bootstrap.hash, []))
+
+    def _add_to_frontier(
+        self, checkpoints: list[Commit], commits: Iterable[Commit]
+    ) -> list[Commit]:
+        """Add commits to a list of checkpoints, keeping only the frontier."""
+        for commit in commits:
+            if commit in checkpoints or any(
+                self.repo.descendant_of(c, commit) for c in checkpoints
+            ):
+                continue
+            checkpoints = [
+                c for c in checkpoints if not self.repo.descendant_of(commit, c)
+            ]
+            checkpoints.append(commit)
+        return checkpoints[-MAX_CHECKPOINTS:]
+
+    def add_checkpoints(self, bootstrap: Commit, commits: Iterable[Commit]) -> None:
+        """Record verified commits as checkpoints of a bootstrap.
+
+        Only the frontier is kept, dropping checkpoints which are ancestors of
+        other checkpoints.
+        """
+        current = self.get_checkpoints(bootstrap)
+        checkpoints = self._add_to_frontier(current, commits)
+        if checkpoints != current:
+            self._load_checkpoints()[bootstrap.hash] = [c.hash for c in checkpoints]
+            self._checkpoints_changed.add(bootstrap.hash)
+
+    def _save_checkpoints(self) -> None:
+        if self._checkpoints is None or not self._checkpoints_changed:
+            return
+        path = os.path.join(self.bark_directory, PROJECT_FILES.CHECKPOINTS)
+        # Merge with checkpoints saved by other processes since they were loaded
+        with file_lock(path):
+            checkpoints = self._read_checkpoints()
+            for bs in self._checkpoints_changed:
+                if bs in self._checkpoints:
+                    checkpoints[bs] = [
+                        c.hash
+                        for c in self._add_to_frontier(
+                            self._to_commits(checkpoints.get(bs, [])),
+                            self._to_commits(self._checkpoints[bs]),
+                        )
+                    ]
+                else:
+                    checkpoints.pop(bs, None)
+            data = {
+                bs.hex(): [c.hex() for c in commits]
+                for bs, commits in checkpoints.items()
+            }
+            with atomic_write(path) as f:
+                json.dump(data, f)
+        self._checkpoints = checkpoints
+        self._checkpoints_changed.clear()
+
+    def _read_ref_states(self) -> dict[str, RefState]:
+        path = os.path.join(self.bark_directory, PROJECT_FILES.REF_SNAPSHOT)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            return {
+                ref: RefState(
+                    bytes.fromhex(state["tip"]),
+                    bytes.fromhex(state["rules"]),
+                    state["valid"],
+                )
+                for ref, state in data.items()
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
+
+    def get_ref_states(self) -> dict[str, RefState]:
+        """Get the snapshot of verified refs, as of their last verification."""
+        if self._ref_states is None:
+            self._ref_states = self._read_ref_states()
+        return dict(self._ref_states)
+
+    def record_ref_states(
+        self, states: dict[str, RefState], replace: bool = False
+    ) -> None:
+        """Record the results of verifying refs in the snapshot.
+
+        If replace is set, refs not given are removed from the snapshot.
+        """
+        previous = self.get_ref_states()
+        current = dict(states) if replace else {**previous, **states}
+        if current != previous:
+            self._ref_states = current
+            self._ref_states_changed.update(
+                ref for ref, state in states.items() if previous.get(ref) != state
+            )
+            self._ref_states_replaced |= replace
+
+    def _save_ref_states(self) -> None:
+        if self._ref_states is None or not (
+            self._ref_states_changed or self._ref_states_replaced
+        ):
+            return
+        path = os.path.join(self.bark_directory, PROJECT_FILES.REF_SNAPSHOT)
+        # Merge with results saved by other processes since they were loaded
+        with file_lock(path):
+            if self._ref_states_replaced:
+                states = dict(self._ref_states)
+            else:
+                states = self._read_ref_states()
+                states.update(
+                    (ref, self._ref_states[ref]) for ref in self._ref_states_changed
+                )
+            data = {
+                ref: {
+                    "tip": state.tip.hex(),
+                    "rules": state.rules.hex(),
+                    "valid": state.valid,
+                }
+                for ref, state in states.items()
+            }
+            with atomic_write(path) as f:
+                json.dump(data, f)
+        self._ref_states = states
+        self._ref_states_changed.clear()
+        self._ref_states_replaced = False
 
     def _load_bootstrap(self) -> Optional[Commit]:
         bootstrap_file = os.path.join(self.bark_directory, PROJECT_FILES.BOOTSTRAP)
@@ -137,10 +403,21 @@ class Project:
     def _save_bootstrap(self) -> None:
         if self.bootstrap:
             bootstrap_file = os.path.join(self.bark_directory, PROJECT_FILES.BOOTSTRAP)
-            with open(bootstrap_file, "w") as f:
+            with atomic_write(bootstrap_file) as f:
                 f.write(self.bootstrap.hash.hex())
 
+    def flush(self) -> None:
+        """Persist changes, keeping caches open for further use."""
+        self._save_bootstrap()
+        self._save_checkpoints()
+        self._save_ref_states()
+        for cache in self._caches.values():
+            cache.flush()
+
     def update(self) -> None:
         self._save_bootstrap()
+        self._save_checkpoints()
+        self._save_ref_states()
         for cache in self._caches.values():
             cache.close()
+        self._caches.clear()
@@ -0,0 +1,130 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .util import atomic_write
+
+from importlib.metadata import entry_points, EntryPoint
+from typing import Any, Optional
+import json
+import sys
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMMIT_RULES_GROUP = "bark_commit_rules"
+REF_RULES_GROUP = "bark_ref_rules"
+COMMANDS_GROUP = "bark_commands"
+GROUPS = (COMMIT_RULES_GROUP, REF_RULES_GROUP, COMMANDS_GROUP)
+
+
+def _get_signature() -> list[list]:
+    """The distributions on sys.path, and the state of their entry points.
+
+    Installing, upgrading or removing a distribution adds or removes its
+    metadata directory, and rewrites its entry_points.txt. Directories without
+    distributions, such as the script directory, don't affect the signature.
+    """
+    signature = []
+    for path in sys.path:
+        try:
+            names = sorted(os.listdir(path or "."))
+        except OSError:
+            continue
+        for name in names:
+            if not name.endswith((".dist-info", ".egg-info")):
+                continue
+            metadata = os.path.join(os.path.abspath(path), name)
+            entry_points_txt = os.path.join(metadata, "entry_points.txt")
+            try:
+                mtime: Optional[int] = os.stat(entry_points_txt).st_mtime_ns
+            except OSError:
+                mtime = None
+            signature.append([metadata, mtime])
+    return signature
+
+
+class Registry:
+    """Registry of the entry points provided by bark modules.
+
+    Entry points are scanned once, and the name to "module:attr" map is
+    persisted to a file, which is used for as long as the installed
+    distributions are unchanged.
+    Loaded entry points are kept for the lifetime of the process.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._path = path
+        self._entries: Optional[dict[str, dict[str, str]]] = None
+        self._loaded: dict[tuple[str, str], Any] = {}
+
+    def configure(self, path: Optional[str]) -> None:
+        """Set the file used to persist the registry."""
+        self._path = path
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """Re-scan entry points on next use, e.g. after installing modules."""
+        self._entries = None
+        self._loaded.clear()
+
+    def _read(self, signature: list[list]) -> Optional[dict[str, dict[str, str]]]:
+        if not self._path:
+            return None
+        try:
+            with open(self._path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("signature") != signature:
+            logger.debug("The registry is out of date")
+            return None
+        return data["entries"]
+
+    def _write(self, signature: list[list]) -> None:
+        if not self._path:
+            return
+        try:
+            with atomic_write(self._path) as f:
+                json.dump({"signature": signature, "entries": self._entries}, f)
+        except OSError:
+            logger.debug("Could not persist the registry", exc_info=True)
+
+    @property
+    def entries(self) -> dict[str, dict[str, str]]:
+        if self._entries is None:
+            signature = _get_signature()
+            self._entries = self._read(signature)
+            if self._entries is None:
+                logger.debug("Scanning entry points")
+                self._entries = {
+                    group: {ep.name: ep.value for ep in entry_points(group=group)}
+                    for group in GROUPS
+                }
+                self._write(signature)
+        return self._entries
+
+    def names(self, group: str) -> list[str]:
+        return list(self.entries[group])
+
+    def load(self, group: str, name: str) -> Any:
+        """Load an entry point, raising KeyError if it does not exist."""
+        key = (group, name)
+        if key not in self._loaded:
+            value = self.entries[group][name]
+            self._loaded[key] = EntryPoint(name, value, group).load()
+        return self._loaded[key]
+
+
+registry = Registry()
@@ -15,10 +15,29 @@
 from .git import Commit
 from .objects import RuleData
 from .project import Cache
+from .registry import registry, COMMIT_RULES_GROUP, REF_RULES_GROUP
 
 from abc import ABC, abstractmethod
-from typing import Any, Optional, ClassVar, Callable, Union
-from importlib.metadata import entry_points
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional, ClassVar, Callable, Iterator, Union
+
+# Number of failures of each rule, while failing fast
+_failures: ContextVar[Optional[dict[str, int]]] = ContextVar("failures", default=None)
+
+
+@contextmanager
+def fail_fast_rules() -> Iterator[None]:
+    """Stop evaluating composite rules at their first violation.
+
+    Within the context, the child rules which have failed most often are
+    evaluated first.
+    """
+    token = _failures.set({})
+    try:
+        yield
+    finally:
+        _failures.reset(token)
 
 
 class RuleViolation(Exception):
@@ -61,7 +80,7 @@ class CommitRule(_Rule):
 
     @staticmethod
     def load_rule(rule: RuleData, commit: Commit, cache: Cache) -> "CommitRule":
-        rule_cls = entry_points(group="bark_commit_rules")[rule.id].load()
+        rule_cls = registry.load(COMMIT_RULES_GROUP, rule.id)
         return rule_cls(rule.id, commit, cache, rule.args)
 
 
@@ -72,7 +91,7 @@ class RefRule(_Rule):
 
     @staticmethod
     def load_rule(rule: RuleData, commit: Commit, cache: Cache) -> "RefRule":
-        rule_cls = entry_points(group="bark_ref_rules")[rule.id].load()
+        rule_cls = registry.load(REF_RULES_GROUP, rule.id)
         return rule_cls(rule.id, commit, cache, rule.args)
 
 
@@ -93,15 +112,31 @@ class _CompositeRule(_Rule):
                 raise ValueError("Composite rule must contain at least 2 child rules!")
 
     def _validate_children(
-        self, commit: Commit, ref: Optional[str]
+        self, commit: Commit, ref: Optional[str], until_valid: bool = False
     ) -> list[RuleViolation]:
+        """Validate the child rules, returning their violations.
+
+        If until_valid is set, stops at the first child which passes. When
+        failing fast, stops at the first violation otherwise.
+        """
         args = (commit, ref) if ref is not None else (commit,)
+        failures = _failures.get()
+        counts = failures or {}
+        sub_rules = self.sub_rules
+        if counts:
+            sub_rules = sorted(sub_rules, key=lambda r: -counts.get(r.name, 0))
         violations = []
-        for rule in self.sub_rules:
+        for rule in sub_rules:
             try:
                 rule.validate(*args)
+                if until_valid:
+                    break
             except RuleViolation as e:
                 violations.append(e)
+                if failures is not None:
+                    failures[rule.name] = failures.get(rule.name, 0) + 1
+                    if not until_valid:
+                        break
         return violations
 
 
@@ -126,7 +161,7 @@ class AllRefRule(_AllRule, RefRule):
 
 class _AnyRule(_CompositeRule):
     def validate(self, commit: Commit, ref: Optional[str] = None):
-        violations = self._validate_children(commit, ref)
+        violations = self._validate_children(commit, ref, until_valid=True)
         if len(self.sub_rules) - len(violations) <= 0:
             raise RuleViolation(
                 "One of the following conditions must be met:", violations
@@ -12,11 +12,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from contextlib import contextmanager
+from typing import Any, Iterator, TextIO
 import subprocess
-from typing import Any
+import fcntl
+import os
 
 
 def cmd(*cmd: str, check: bool = True, text: bool = True, **kwargs: Any):
 
     result = subprocess.run(cmd, capture_output=True, text=text, check=check, **kwargs)
     return result.stdout.strip(), result.returncode
+
+
+@contextmanager
+def atomic_write(path: str) -> Iterator[TextIO]:
+    """Write a file through a temporary file, which then replaces it.
+
+    Each writer uses its own temporary file, so readers always see a complete
+    file, even with concurrent writers.
+    """
+    import tempfile
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}."
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Hold an exclusive lock for a file, using a separate lock file."""
+    with open(f"{path}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,180 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .core import get_bark_rules_commit, BARK_RULES_REF
+from .objects import BarkRules
+from .git import Commit
+from .rule import RuleViolation
+from .project import Project, PROJECT_FILES
+from .commands.verify import (
+    verify_bark_rules,
+    verify_ref,
+    verify_commit,
+    verify_ref_updates,
+    RefUpdate,
+)
+
+from dataclasses import dataclass
+from typing import Iterable, Optional
+import threading
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class VerificationResult:
+    """The result of verifying a ref or a commit."""
+
+    target: str
+    commit: bytes
+    violation: Optional[RuleViolation] = None
+
+    @property
+    def valid(self) -> bool:
+        return self.violation is None
+
+
+class Verifier:
+    """Verifies refs and commits of a repository.
+
+    The project, its caches, loaded rule modules and the verified bark rules
+    are kept between calls, and bark_rules is only re-verified when it changes.
+    Calls are serialized, so a Verifier can be shared between threads.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.RLock()
+        self._project = Project(path)
+        self._bootstrap_file = os.path.join(
+            self._project.bark_directory, PROJECT_FILES.BOOTSTRAP
+        )
+        self._bootstrap_state = self._get_bootstrap_state()
+        self._bark_rules: Optional[tuple[bytes, BarkRules]] = None
+
+    def _get_bootstrap_state(self) -> Optional[int]:
+        try:
+            return os.stat(self._bootstrap_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @property
+    def project(self) -> Project:
+        """The project, reloaded if the trusted bootstrap has changed."""
+        with self._lock:
+            bootstrap_state = self._get_bootstrap_state()
+            if bootstrap_state != self._bootstrap_state:
+                logger.debug("The bootstrap has changed, reloading the project")
+                self._project.update()
+                self._project = Project(self._project.path)
+                self._bootstrap_state = bootstrap_state
+                self._bark_rules = None
+            return self._project
+
+    def _verify_rules(self, project: Project) -> BarkRules:
+        """Get the bark rules, verifying bark_rules only if it has changed."""
+        head = get_bark_rules_commit(project)
+        head_hash = head.hash if head else b""
+        if self._bark_rules is None or self._bark_rules[0] != head_hash:
+            self._bark_rules = (head_hash, verify_bark_rules(project))
+        return self._bark_rules[1]
+
+    def verify_ref(self, ref: str, head: Optional[Commit] = None) -> VerificationResult:
+        """Verify a ref, at its current target unless head is given."""
+        with self._lock:
+            project = self.project
+            head = head or project.repo.references[ref]
+            try:
+                verify_ref(project, ref, head, self._verify_rules)
+            except RuleViolation as e:
+                return VerificationResult(ref, head.hash, e)
+            finally:
+                project.flush()
+            return VerificationResult(ref, head.hash)
+
+    def verify_refs(
+        self, refs: Optional[Iterable[str]] = None
+    ) -> list[VerificationResult]:
+        """Verify refs at their current targets.
+
+        By default, all refs matching any ref rules are verified.
+        """
+        with self._lock:
+            if refs is None:
+                project = self.project
+                try:
+                    rules = self._verify_rules(project).get_ref_rules()
+                except RuleViolation as e:
+                    head = project.repo.references[BARK_RULES_REF]
+                    return [VerificationResult(BARK_RULES_REF, head.hash, e)]
+                finally:
+                    project.flush()
+                refs = [
+                    ref
+                    for ref in self.project.repo.references
+                    if any(r.pattern.match(ref) for r in rules)
+                ]
+            return [self.verify_ref(ref) for ref in refs]
+
+    def verify_commit(self, commit: Commit, bootstrap: Commit) -> VerificationResult:
+        """Verify the commit rules of a commit, from a bootstrap."""
+        with self._lock:
+            project = self.project
+            try:
+                verify_commit(project, commit, bootstrap)
+            except RuleViolation as e:
+                return VerificationResult(commit.hash.hex(), commit.hash, e)
+            finally:
+                project.flush()
+            return VerificationResult(commit.hash.hex(), commit.hash)
+
+    def verify_ref_update(
+        self, old: str, new: str, ref: str
+    ) -> Optional[VerificationResult]:
+        """Verify a ref update reported by the reference-transaction hook.
+
+        Returns None if the update does not need verification.
+        """
+        results = self.verify_ref_updates([(old, new, ref)])
+        return results[0] if results else None
+
+    def verify_ref_updates(
+        self, updates: Iterable[RefUpdate], all_commits: bool = False
+    ) -> list[VerificationResult]:
+        """Verify the ref updates of a transaction, as one batch.
+
+        If all_commits is set, every commit added by an update is verified, not
+        only its new target. Results are returned for the updates which need
+        verification. The transaction should be rejected if any of them is
+        invalid.
+        """
+        updates = list(updates)
+        targets = {ref: bytes.fromhex(new) for _, new, ref in updates}
+        with self._lock:
+            project = self.project
+            try:
+                results = verify_ref_updates(
+                    project, updates, self._verify_rules, all_commits
+                )
+            finally:
+                project.flush()
+            return [
+                VerificationResult(ref, targets[ref], violation)
+                for ref, violation in results.items()
+            ]
+
+    def close(self) -> None:
+        with self._lock:
+            self._project.update()
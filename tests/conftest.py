@@ -66,7 +66,9 @@ def repo_initialized_dump(
 def repo_installed_dump(
     repo_initialized_dump: tuple[Repository, str], tmp_path_factory, bark_cli
 ):
-    repo, _ = repo_initialized_dump
+    repo, initialized_path = repo_initialized_dump
+    # Tests may have left state, such as caches, in the shared repository
+    restore_from_dump(repo, initialized_path)
 
     with on_dir(repo._path):
         bark_cli("install", input="y")
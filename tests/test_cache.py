@@ -0,0 +1,168 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.cache import CACHE_BACKENDS, SqliteCache, open_cache
+from gitbark.commands.cache import _open_export
+from gitbark.project import CACHE_NAME_PATTERN
+from gitbark.util import cmd
+from gitbark.git import Repository
+
+from pytest_gitbark.util import on_dir
+
+from types import SimpleNamespace
+import pytest
+import os
+
+
+def _cache_files(repo: Repository) -> list[str]:
+    cache_dir = os.path.join(repo._path, ".git", "bark", "cache")
+    return [
+        os.path.join(cache_dir, f)
+        for f in os.listdir(cache_dir)
+        if CACHE_NAME_PATTERN.match(f)
+    ]
+
+
+def _cached_hashes(path: str) -> set[bytes]:
+    cache = open_cache(path)
+    try:
+        return {h for h, _ in cache.entries()}
+    finally:
+        cache.close()
+
+
+@pytest.mark.parametrize("backend", CACHE_BACKENDS.values())
+class TestCacheBackend:
+    def test_set_get_remove(self, backend, tmp_path):
+        path = str(tmp_path / f"cache{backend.extension}")
+        a, b = SimpleNamespace(hash=b"\xaa" * 20), SimpleNamespace(hash=b"\xbb" * 20)
+
+        cache = backend(path)
+        assert cache.get(a) is None
+        cache.set(b, False)
+        cache.set(a, True)
+        cache.set(a, False)  # Existing entries are kept
+        assert cache.get(a) is True
+        assert list(cache.entries()) == [(a.hash, True), (b.hash, False)]
+        cache.close()
+
+        cache = backend(path)
+        cache.remove(b)
+        assert not cache.has(b)
+        cache.compact()
+        assert list(cache.entries()) == [(a.hash, True)]
+        assert len(cache) == 1
+        cache.close()
+
+    def test_entries_sorted(self, backend, tmp_path):
+        path = str(tmp_path / f"cache{backend.extension}")
+        hashes = [os.urandom(20) for _ in range(100)]
+
+        cache = backend(path)
+        cache.set_many((h, True) for h in hashes[:50])
+        cache.compact()
+        cache.set_many((h, False) for h in hashes[50:])
+        cache.remove_many(hashes[:10])
+        assert [h for h, _ in cache.entries()] == sorted(hashes[10:])
+        cache.close()
+
+
+class TestCacheGc:
+    def test_gc_removes_unreachable(self, repo_installed: Repository, bark_cli):
+        cmd("git", "commit", "-m", "Dropped", "--allow-empty", cwd=repo_installed._path)
+        dropped = repo_installed.head.hash
+        cmd("git", "reset", "--hard", "HEAD~1", cwd=repo_installed._path)
+        cmd(
+            "git", "reflog", "expire", "--expire=now", "--all", cwd=repo_installed._path
+        )
+
+        assert any(dropped in _cached_hashes(p) for p in _cache_files(repo_installed))
+        with on_dir(repo_installed._path):
+            bark_cli("cache", "gc", "--grace-period", "0")
+        assert all(
+            dropped not in _cached_hashes(p) for p in _cache_files(repo_installed)
+        )
+
+    def test_gc_keeps_young_unreachable(self, repo_installed: Repository, bark_cli):
+        cmd("git", "commit", "-m", "Dropped", "--allow-empty", cwd=repo_installed._path)
+        dropped = repo_installed.head.hash
+        cmd("git", "reset", "--hard", "HEAD~1", cwd=repo_installed._path)
+        cmd(
+            "git", "reflog", "expire", "--expire=now", "--all", cwd=repo_installed._path
+        )
+
+        with on_dir(repo_installed._path):
+            bark_cli("cache", "gc")
+        assert any(dropped in _cached_hashes(p) for p in _cache_files(repo_installed))
+
+    def test_gc_removes_unused_caches(self, repo_installed: Repository, bark_cli):
+        cmd("git", "commit", "-m", "Kept", "--allow-empty", cwd=repo_installed._path)
+        unused = os.path.join(
+            repo_installed._path, ".git", "bark", "cache", f"{'ab' * 20}.db"
+        )
+        SqliteCache(unused).close()
+
+        with on_dir(repo_installed._path):
+            bark_cli("cache", "gc")
+        assert not os.path.exists(unused)
+        assert _cache_files(repo_installed)
+
+    def test_auto_gc_ignores_invalid_interval(self, repo_installed: Repository):
+        cmd("git", "config", "bark.gcInterval", "weekly", cwd=repo_installed._path)
+        cmd("git", "commit", "-m", "Kept", "--allow-empty", cwd=repo_installed._path)
+        marker = os.path.join(repo_installed._path, ".git", "bark", "gc.last")
+        assert not os.path.exists(marker)
+
+
+class TestCacheExport:
+    def test_export_import(self, repo_installed: Repository, bark_cli, tmp_path):
+        cmd("git", "commit", "-m", "Cached", "--allow-empty", cwd=repo_installed._path)
+        export = str(tmp_path / "cache.bin")
+        before = {
+            os.path.basename(p): _cached_hashes(p) for p in _cache_files(repo_installed)
+        }
+
+        with on_dir(repo_installed._path):
+            bark_cli("cache", "export", export)
+            for p in _cache_files(repo_installed):
+                os.remove(p)
+            bark_cli("cache", "import", export)
+
+        after = {
+            os.path.basename(p): _cached_hashes(p) for p in _cache_files(repo_installed)
+        }
+        assert after == before
+
+    def test_export_incremental(self, repo_installed: Repository, bark_cli, tmp_path):
+        cmd("git", "commit", "-m", "Cached", "--allow-empty", cwd=repo_installed._path)
+        full = str(tmp_path / "full.bin")
+        delta = str(tmp_path / "delta.bin")
+
+        with on_dir(repo_installed._path):
+            bark_cli("cache", "export", full)
+            cmd("git", "commit", "-m", "New", "--allow-empty", cwd=repo_installed._path)
+            bark_cli("cache", "export", delta, "--base", full)
+            new = repo_installed.head.hash
+
+        with _open_export(delta) as (_, sections):
+            assert [oid for s in sections for oid, _ in s] == [new]
+
+
+def test_log_backend(repo_installed: Repository):
+    cmd("git", "config", "bark.cacheBackend", "log", cwd=repo_installed._path)
+    cmd("git", "commit", "-m", "Cached", "--allow-empty", cwd=repo_installed._path)
+
+    caches = _cache_files(repo_installed)
+    assert caches and all(p.endswith(".log") for p in caches)
+    assert any(repo_installed.head.hash in _cached_hashes(p) for p in caches)
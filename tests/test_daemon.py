@@ -0,0 +1,108 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.client import DAEMON_SOCKET, DAEMON_PYTHON
+from gitbark.util import cmd
+from gitbark.git import Repository
+
+from pytest_gitbark.util import verify_action, write_commit_rules, on_dir
+
+from typing import Optional
+import subprocess
+import shutil
+import socket
+import pytest
+import time
+import sys
+import os
+
+
+def _wait_for_socket(socket_path: str) -> None:
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.1)
+
+
+def _socket_id(socket_path: str) -> Optional[tuple[int, int]]:
+    try:
+        st = os.stat(socket_path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_ctime_ns
+
+
+def _wait_for_new_socket(socket_path: str, previous: tuple[int, int]) -> None:
+    """Wait for a restarted daemon to replace its socket."""
+    for _ in range(100):
+        if _socket_id(socket_path) not in (None, previous):
+            return
+        time.sleep(0.1)
+    raise AssertionError("The daemon did not restart")
+
+
+@pytest.fixture
+def daemon(repo_installed: Repository):
+    bark_directory = os.path.join(repo_installed._path, ".git", "bark")
+    socket_path = os.path.join(bark_directory, DAEMON_SOCKET)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gitbark.cli", "daemon"], cwd=repo_installed._path
+    )
+    _wait_for_socket(socket_path)
+    yield socket_path
+    subprocess.run(
+        [sys.executable, "-m", "gitbark.cli", "daemon", "--stop"],
+        cwd=repo_installed._path,
+    )
+    process.wait(timeout=10)
+    assert not os.path.exists(socket_path)
+
+
+def test_daemon_verifies_updates(repo_installed: Repository, daemon):
+    # The daemon restarts once the env is created by the first update
+    socket_id = _socket_id(daemon)
+    assert socket_id
+    cmd("git", "commit", "-m", "First", "--allow-empty", cwd=repo_installed._path)
+    _wait_for_new_socket(daemon, socket_id)
+
+    # Make sure bark is not run by the hook itself
+    env = dict(os.environ, PATH=os.path.dirname(shutil.which("git")))
+
+    def commit(repo: Repository):
+        cmd("git", "commit", "-m", "Test", "--allow-empty", cwd=repo._path, env=env)
+
+    verify_action(repo_installed, True, commit)
+
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    commit(repo_installed)
+    verify_action(repo_installed, False, commit)
+
+
+def test_stale_socket_falls_back(repo_installed: Repository):
+    bark_directory = os.path.join(repo_installed._path, ".git", "bark")
+    # A socket left behind by a daemon which is no longer running
+    with on_dir(bark_directory), socket.socket(socket.AF_UNIX) as s:
+        s.bind(DAEMON_SOCKET)
+    with open(os.path.join(bark_directory, DAEMON_PYTHON), "w") as f:
+        f.write(sys.executable)
+
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Add rules", cwd=repo_installed._path)
+    verify_action(
+        repo_installed,
+        False,
+        lambda repo: cmd(
+            "git", "commit", "-m", "Test", "--allow-empty", cwd=repo._path
+        ),
+    )
@@ -0,0 +1,62 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import sys
+import os
+
+# Modules imported when a hook runs 'bark ref-update'
+HOOK_MODULES = [
+    "gitbark.cli.__main__",
+    "gitbark.commands.verify",
+    "gitbark.commands.auto_gc",
+]
+
+# Cumulative import time budget for HOOK_MODULES, in microseconds
+IMPORT_TIME_BUDGET = int(os.environ.get("BARK_IMPORT_TIME_BUDGET", 300_000))
+
+# Modules which must not be imported on the hook path
+FORBIDDEN_MODULES = {
+    "pkg_resources",
+    "gitbark.commands.setup",
+    "gitbark.commands.install",
+    "gitbark.commands.notes",
+    "gitbark.commands.cache",
+}
+
+
+def _import_times() -> dict[str, int]:
+    """Get the cumulative import time of each imported module."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(HOOK_MODULES)}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    times = {}
+    for line in stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_hook_imports_within_budget():
+    # Use the fastest of a few runs, to reduce noise
+    runs = [_import_times() for _ in range(3)]
+    total = min(sum(times[m] for m in HOOK_MODULES) for times in runs)
+    assert total <= IMPORT_TIME_BUDGET
+
+
+def test_hook_does_not_import_unneeded_modules():
+    assert not FORBIDDEN_MODULES & set(_import_times())
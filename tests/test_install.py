@@ -12,10 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from gitbark.core import BARK_RULES_REF
 from gitbark.git import Repository
+from gitbark.util import cmd
 
 from pytest_gitbark.util import on_dir
 import pytest
+import os
 
 
 class TestInstall:
@@ -32,3 +35,14 @@ class TestInstall:
 
     def test_install_with_initialized(self, repo_initialized: Repository, bark_cli):
         self.verify_install(repo=repo_initialized, bark_cli=bark_cli, passes=True)
+
+    def test_hook_writes_ref_prefilter(self, repo_initialized: Repository, bark_cli):
+        self.verify_install(repo=repo_initialized, bark_cli=bark_cli, passes=True)
+        bark_directory = os.path.join(repo_initialized._path, ".git", "bark")
+        # Installing does not verify anything, the first ref update does
+        assert not os.listdir(os.path.join(bark_directory, "cache"))
+        cmd("git", "commit", "-m", "Test", "--allow-empty", cwd=repo_initialized._path)
+        with open(os.path.join(bark_directory, "ref_prefilter")) as f:
+            head, *prefixes = f.read().splitlines()
+        assert head == repo_initialized.references[BARK_RULES_REF].hash.hex()
+        assert prefixes == ["refs/heads/bark_rules", "refs/heads/main"]
@@ -0,0 +1,101 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.project import Project
+from gitbark.core import BARK_RULES_BRANCH, BARK_REQUIREMENTS
+from gitbark.commands.modules import prefetch
+from gitbark.env import EnvStore
+from gitbark.util import cmd
+from gitbark.git import Repository
+from gitbark import env
+
+from pytest_gitbark.util import on_dir, on_branch, uninstall_hooks, write_bark_file
+
+from importlib.metadata import distributions
+import os
+
+
+def test_gc_envs(repo_installed: Repository, bark_cli):
+    cmd("git", "commit", "-m", "First", "--allow-empty", cwd=repo_installed._path)
+    project = Project(repo_installed._path)
+    used = project.get_env_site_packages()
+    project.install_modules(b"# Unused\n")
+    unused = project.get_env_site_packages()
+    project.update()
+
+    # Verifying selects the env required by bark_rules again
+    cmd("git", "commit", "-m", "Second", "--allow-empty", cwd=repo_installed._path)
+    with on_dir(repo_installed._path):
+        bark_cli("modules", "gc")
+
+    store = Project(repo_installed._path).get_env_store()
+    assert len(store.envs()) == 1
+    assert used.startswith(store.path)
+    assert not unused.startswith(os.path.join(store.path, store.envs()[0]))
+
+
+def test_prefetch_installs_offline(repo_installed: Repository, bark_cli, monkeypatch):
+    with on_dir(repo_installed._path):
+        bark_cli("modules", "prefetch")
+
+    # Make any package index unreachable
+    monkeypatch.setenv("PIP_INDEX_URL", "http://127.0.0.1:9/simple")
+    monkeypatch.delenv("PIP_EXTRA_INDEX_URL", raising=False)
+    monkeypatch.setenv("PIP_RETRIES", "0")
+
+    cmd("git", "commit", "-m", "Test", "--allow-empty", cwd=repo_installed._path)
+    site_packages = Project(repo_installed._path).get_env_site_packages()
+    assert "test-bark-core" in {
+        d.metadata["Name"] for d in distributions(path=[site_packages])
+    }
+
+
+def test_prefetch_skips_unverified_commits(repo_installed: Repository, monkeypatch):
+    path = repo_installed._path
+    with uninstall_hooks(repo_installed):
+        with on_branch(repo_installed, BARK_RULES_BRANCH):
+            write_bark_file(
+                repo_installed, f"{path}/{BARK_REQUIREMENTS}", "untrusted\n"
+            )
+            cmd("git", "commit", "-m", "Untrusted requirements", cwd=path)
+
+    prefetched = []
+    monkeypatch.setattr(
+        EnvStore, "prefetch", lambda self, r: prefetched.append(r) or True
+    )
+    project = Project(path)
+    assert prefetch(project) == len(prefetched)
+    project.update()
+    assert prefetched
+    assert b"untrusted\n" not in prefetched
+
+
+def test_install_wheels_compares_versions(tmp_path, monkeypatch):
+    for name in [
+        "same-1.0-py3-none-any.whl",
+        "newer-2.0-py3-none-any.whl",
+        "pinned-1.0-py3-none-any.whl",
+    ]:
+        (tmp_path / name).touch()
+    installed = {"same": "1.0", "newer": "1.0", "pinned": "1.0"}
+    monkeypatch.setattr(env, "_get_installed", lambda paths: installed)
+    commands = []
+    monkeypatch.setattr(env, "cmd", lambda *args: commands.append(args))
+
+    env._install_wheels("python", str(tmp_path), b"same\npinned==2.0\n", [])
+    (args,) = commands
+    assert [os.path.basename(a) for a in args if a.endswith(".whl")] == [
+        "newer-2.0-py3-none-any.whl",
+        "pinned-1.0-py3-none-any.whl",
+    ]
@@ -0,0 +1,87 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.commands.notes import NOTES_REF
+from gitbark.util import cmd
+from gitbark.git import Repository
+
+from pytest_gitbark.util import on_dir
+
+from .test_cache import _cache_files, _cached_hashes
+
+import pytest
+import os
+
+
+def test_publish_and_import_notes(repo_installed: Repository, bark_cli, tmp_path):
+    cmd("git", "commit", "-m", "First", "--allow-empty", cwd=repo_installed._path)
+    cmd("git", "commit", "-m", "Second", "--allow-empty", cwd=repo_installed._path)
+    head = repo_installed.head.hash
+
+    # Share the notes through a bare repository
+    remote = str(tmp_path / "remote.git")
+    cmd("git", "init", "--bare", remote)
+    with on_dir(repo_installed._path):
+        bark_cli("notes", "publish")
+        note = cmd("git", "notes", "--ref", NOTES_REF, "show", head.hex())[0]
+        assert note.startswith("bark 1 ")
+
+        cmd("git", "push", remote, NOTES_REF)
+        cmd("git", "update-ref", "-d", NOTES_REF)
+        cmd("git", "fetch", remote, f"{NOTES_REF}:{NOTES_REF}")
+
+        for path in _cache_files(repo_installed):
+            os.remove(path)
+        bark_cli("notes", "import", "--sample", "2", "--allow-unsigned")
+
+    assert any(head in _cached_hashes(p) for p in _cache_files(repo_installed))
+
+
+def _ssh_key(tmp_path, name: str) -> tuple[str, str]:
+    """Generate an SSH key, returning the private key path and an allowed signers
+    file for it."""
+    key = str(tmp_path / name)
+    cmd("ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-f", key)
+    allowed_signers = str(tmp_path / f"{name}_allowed_signers")
+    with open(f"{key}.pub") as f, open(allowed_signers, "w") as out:
+        out.write(f"test@example.com {f.read()}")
+    return key, allowed_signers
+
+
+def test_import_requires_trusted_signer(repo_installed: Repository, bark_cli, tmp_path):
+    path = repo_installed._path
+    cmd("git", "commit", "-m", "First", "--allow-empty", cwd=path)
+    signing_key, allowed_signers = _ssh_key(tmp_path, "signer")
+    _, other_signers = _ssh_key(tmp_path, "other")
+
+    with on_dir(path):
+        # Unsigned notes are only imported when explicitly allowed
+        bark_cli("notes", "publish")
+        cmd("git", "config", "bark.notesAllowedSigners", allowed_signers)
+        with pytest.raises(SystemExit):
+            bark_cli("notes", "import")
+        with pytest.raises(SystemExit):
+            bark_cli("notes", "import", "--allow-unsigned", "--sample", "0")
+
+        cmd("git", "config", "gpg.format", "ssh")
+        cmd("git", "config", "user.signingkey", signing_key)
+        bark_cli("notes", "publish", "--sign")
+        with pytest.raises(SystemExit):
+            bark_cli("notes", "import", "--allowed-signers", other_signers)
+        bark_cli("notes", "import")
+
+        # A signature is not enough without any trusted key
+        cmd("git", "config", "--unset", "bark.notesAllowedSigners")
+        with pytest.raises(SystemExit):
+            bark_cli("notes", "import")
@@ -0,0 +1,72 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.util import cmd
+from gitbark.git import Repository
+from gitbark.project import Project
+
+from pytest_gitbark.util import write_commit_rules, on_branch, on_dir
+
+import subprocess
+import pytest
+import os
+
+
+@pytest.fixture
+def remote(repo_installed: Repository, tmp_path, bark_cli) -> str:
+    with on_dir(repo_installed._path):
+        bark_cli("install", "--pre-push")
+    hook = os.path.join(repo_installed._path, ".git", "hooks", "pre-push")
+    assert os.path.exists(hook)
+
+    path = str(tmp_path / "remote.git")
+    cmd("git", "init", "--bare", path)
+    cmd("git", "push", f"file://{path}", "main", cwd=repo_installed._path)
+    return path
+
+
+def _push(repo: Repository, remote: str, *refs: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        ["git", "push", f"file://{remote}", *refs],
+        cwd=repo._path,
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_push_valid(repo_installed: Repository, remote):
+    cmd("git", "commit", "-m", "Test", "--allow-empty", cwd=repo_installed._path)
+    assert _push(repo_installed, remote, "main").returncode == 0
+    assert Repository(remote).references["refs/heads/main"] == repo_installed.head
+
+
+def test_push_invalid(repo_installed: Repository, remote):
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Skip: add commit rules", cwd=repo_installed._path)
+    # The feature branch has no rules of its own
+    with on_branch(repo_installed, "feature"):
+        cmd("git", "commit", "-m", "Invalid", "--allow-empty", cwd=repo_installed._path)
+    old = Repository(remote).references["refs/heads/main"]
+
+    # The rules of the remote ref apply, not those of the local one
+    assert _push(repo_installed, remote, "feature").returncode == 0
+    result = _push(repo_installed, remote, "feature:main")
+    assert result.returncode != 0
+    assert "branch main was rejected" in result.stdout + result.stderr
+    assert Repository(remote).references["refs/heads/main"] == old
+
+    # Results for remote refs are not recorded as those of local refs
+    invalid = repo_installed.references["refs/heads/feature"]
+    states = Project(repo_installed._path).get_ref_states()
+    assert all(state.tip != invalid.hash for state in states.values())
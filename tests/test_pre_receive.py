@@ -0,0 +1,67 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.util import cmd
+from gitbark.git import Repository
+
+from pytest_gitbark.util import write_commit_rules, uninstall_hooks, on_dir
+
+import subprocess
+import pytest
+import os
+
+
+@pytest.fixture
+def server(repo_installed: Repository, tmp_path, bark_cli) -> str:
+    path = str(tmp_path / "server.git")
+    cmd("git", "clone", "--bare", repo_installed._path, path)
+    with on_dir(path):
+        bark_cli("install", input="y")
+    assert os.path.exists(os.path.join(path, "hooks", "pre-receive"))
+    return path
+
+
+def _push(repo: Repository, server: str, *refs: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        ["git", "push", f"file://{server}", *refs],
+        cwd=repo._path,
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_push_valid(repo_installed: Repository, server):
+    cmd("git", "commit", "-m", "Test", "--allow-empty", cwd=repo_installed._path)
+    cmd("git", "branch", "feature", cwd=repo_installed._path)
+    assert _push(repo_installed, server, "main", "feature").returncode == 0
+    assert Repository(server).references["refs/heads/main"] == repo_installed.head
+
+
+def test_push_invalid(repo_installed: Repository, server):
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Skip: add commit rules", cwd=repo_installed._path)
+    with uninstall_hooks(repo_installed):
+        cmd("git", "commit", "-m", "Invalid", "--allow-empty", cwd=repo_installed._path)
+        cmd("git", "branch", "feature", cwd=repo_installed._path)
+    old = Repository(server).references["refs/heads/main"]
+
+    # The push is rejected as a whole, reporting each rejected ref
+    result = _push(repo_installed, server, "main", "feature")
+    assert result.returncode != 0
+    assert "branch main was rejected" in result.stderr
+    assert "branch feature" not in result.stderr
+
+    references = Repository(server).references
+    assert references["refs/heads/main"] == old
+    assert "refs/heads/feature" not in references
@@ -0,0 +1,156 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.project import Project, RefState
+from gitbark.env import EnvStore, load_env
+from gitbark import env, core
+
+from pytest_gitbark.util import on_dir
+from gitbark.util import cmd
+from gitbark.git import Repository
+
+import subprocess
+import threading
+import time
+import os
+
+
+def _no_subprocess(*args, **kwargs):
+    raise AssertionError(f"Unexpected subprocess: {args}")
+
+
+def _no_validation(commit, cache):
+    raise AssertionError(f"Unexpected validation of {commit}")
+
+
+class TestProject:
+    def test_startup_does_not_fork(self, repo_installed: Repository, monkeypatch):
+        # Create the env
+        cmd("git", "commit", "-m", "Test", "--allow-empty", cwd=repo_installed._path)
+
+        monkeypatch.setattr(subprocess, "run", _no_subprocess)
+        monkeypatch.setattr(subprocess, "Popen", _no_subprocess)
+        project = Project(repo_installed._path)
+        assert project.bootstrap
+        project.update()
+
+    def test_stale_env_metadata(self, repo_installed: Repository):
+        cmd("git", "commit", "-m", "Test", "--allow-empty", cwd=repo_installed._path)
+        project = Project(repo_installed._path)
+        site_packages = project.get_env_site_packages()
+
+        # Recreating the env invalidates the metadata
+        cmd("python", "-m", "venv", "--clear", project._env["path"])
+        project = Project(repo_installed._path)
+        assert project.get_env_site_packages() is None
+
+        cmd("git", "commit", "-m", "Test", "--allow-empty", cwd=repo_installed._path)
+        assert Project(repo_installed._path).get_env_site_packages() == site_packages
+
+    def test_worktrees_share_state(
+        self, repo_installed: Repository, bark_cli, tmp_path, monkeypatch
+    ):
+        cmd("git", "commit", "-m", "Test", "--allow-empty", cwd=repo_installed._path)
+        worktree = str(tmp_path / "worktree")
+        cmd("git", "worktree", "add", worktree, "-b", "other", cwd=repo_installed._path)
+
+        project = Project(repo_installed._path)
+        wt_project = Project(worktree)
+        assert wt_project.bark_directory == project.bark_directory
+        assert wt_project.bootstrap == project.bootstrap
+        assert wt_project.get_env_site_packages() == project.get_env_site_packages()
+        wt_project.update()
+        project.update()
+
+        # The hook runs in the worktree, and results cached by the main
+        # worktree are reused, without creating the env again
+        cmd("git", "commit", "-m", "Other", "--allow-empty", cwd=worktree)
+        monkeypatch.setattr(env, "_create_env", _no_subprocess)
+        monkeypatch.setattr(core, "_validate_rules", _no_validation)
+        with on_dir(worktree):
+            bark_cli("verify", "main")
+
+    def test_concurrent_state_is_merged(self, repo_installed: Repository):
+        head = repo_installed.head
+        first = Project(repo_installed._path)
+        second = Project(repo_installed._path)
+        first.get_ref_states()
+        second.get_ref_states()
+
+        # Each process only writes back the refs it verified
+        first.record_ref_states({"refs/heads/a": RefState(head.hash, b"", True)})
+        second.record_ref_states({"refs/heads/b": RefState(head.hash, b"", False)})
+        first.update()
+        second.update()
+
+        states = Project(repo_installed._path).get_ref_states()
+        assert states["refs/heads/a"].valid
+        assert not states["refs/heads/b"].valid
+
+    def test_envs_keyed_by_requirements(
+        self, repo_installed: Repository, tmp_path, monkeypatch
+    ):
+        store = str(tmp_path / "envs")
+        cmd("git", "config", "bark.envStore", store, cwd=repo_installed._path)
+        project = Project(repo_installed._path)
+        project.install_modules(b"# First\n")
+        first = project.get_env_site_packages()
+        project.install_modules(b"# Second\n")
+        assert project.get_env_site_packages() != first
+
+        # Switching back selects the existing env
+        monkeypatch.setattr(subprocess, "run", _no_subprocess)
+        project.install_modules(b"# First\n")
+        assert project.get_env_site_packages() == first
+        project.update()
+
+        assert EnvStore(store).repositories() == [str(repo_installed._path)]
+        assert len(EnvStore(store).envs()) == 2
+
+
+class TestEnvStore:
+    def test_prepare_envs(self, tmp_path, monkeypatch):
+        commands = []
+
+        def record(*args, **kwargs):
+            commands.append(args)
+            return cmd(*args, **kwargs)
+
+        monkeypatch.setattr(env, "cmd", record)
+        store = EnvStore(str(tmp_path))
+        # Satisfied by modules already installed, so pip is not needed
+        requirements = [b"# No modules\n", b"pyyaml\n", b"click  # Comment\n"]
+        store.prepare_envs(requirements + requirements)
+
+        assert len(store.envs()) == 3
+        assert not [c for c in commands if "pip" in c]
+        assert all(load_env(os.path.join(store.path, h)) for h in store.envs())
+
+    def test_lock_is_removed_while_held(self, tmp_path):
+        store = EnvStore(str(tmp_path))
+        lock_file = os.path.join(store.path, "ab.lock")
+        acquired = []
+
+        def lock():
+            with store._lock("ab"):
+                acquired.append(os.path.exists(lock_file))
+
+        with store._lock("ab", remove=True):
+            waiting = threading.Thread(target=lock)
+            waiting.start()
+            time.sleep(0.1)
+        waiting.join()
+
+        # The waiting lock was taken on a new lock file, not the removed one
+        assert acquired == [True]
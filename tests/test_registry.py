@@ -0,0 +1,60 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.registry import Registry, COMMANDS_GROUP
+
+import json
+import sys
+
+
+class TestRegistry:
+    def test_persisted_entries_are_used(self, tmp_path):
+        path = str(tmp_path / "registry.json")
+        Registry(path).entries
+
+        # Point a command at another object, without changing sys.path
+        with open(path) as f:
+            data = json.load(f)
+        data["entries"][COMMANDS_GROUP]["fake"] = "json:dumps"
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+        assert Registry(path).load(COMMANDS_GROUP, "fake") is json.dumps
+
+    def test_rescan_on_new_distribution(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "registry.json")
+        Registry(path).entries
+
+        site = tmp_path / "site"
+        metadata = site / "fake-1.0.dist-info"
+        metadata.mkdir(parents=True)
+        (metadata / "METADATA").write_text("Name: fake\nVersion: 1.0\n")
+        (metadata / "entry_points.txt").write_text(
+            f"[{COMMANDS_GROUP}]\nfake = json:dumps\n"
+        )
+        monkeypatch.setattr(sys, "path", sys.path + [str(site)])
+        assert Registry(path).load(COMMANDS_GROUP, "fake") is json.dumps
+
+    def test_no_rescan_on_path_without_distributions(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "registry.json")
+        Registry(path).entries
+        with open(path) as f:
+            data = json.load(f)
+        data["entries"][COMMANDS_GROUP]["fake"] = "json:dumps"
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+        # Such as the script directory, in sys.path[0]
+        monkeypatch.setattr(sys, "path", [str(tmp_path)] + sys.path)
+        assert Registry(path).load(COMMANDS_GROUP, "fake") is json.dumps
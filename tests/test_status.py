@@ -0,0 +1,43 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.util import cmd
+from gitbark.git import Repository
+
+from pytest_gitbark.util import write_commit_rules, uninstall_hooks, on_dir
+
+import pytest
+import json
+
+
+def _status(bark_cli, repo: Repository) -> dict[str, str]:
+    with on_dir(repo._path):
+        output = bark_cli("status", "--json").output
+    return {ref: s["status"] for ref, s in json.loads(output).items()}
+
+
+def test_status(repo_installed: Repository, bark_cli):
+    path = repo_installed._path
+    cmd("git", "commit", "-m", "Valid", "--allow-empty", cwd=path)
+    assert _status(bark_cli, repo_installed)["refs/heads/main"] == "valid"
+
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Skip: add commit rules", cwd=path)
+    with uninstall_hooks(repo_installed):
+        cmd("git", "commit", "-m", "Invalid", "--allow-empty", cwd=path)
+    assert _status(bark_cli, repo_installed)["refs/heads/main"] == "unknown"
+
+    with on_dir(path), pytest.raises(SystemExit):
+        bark_cli("verify")
+    assert _status(bark_cli, repo_installed)["refs/heads/main"] == "invalid"
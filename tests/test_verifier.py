@@ -0,0 +1,84 @@
+# Copyright 2023 Yubico AB
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from gitbark.verifier import Verifier
+from gitbark.util import cmd
+from gitbark.git import Repository
+
+from pytest_gitbark.util import write_commit_rules, uninstall_hooks
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_verify_refs_from_threads(repo_installed: Repository):
+    cmd("git", "commit", "-m", "First", "--allow-empty", cwd=repo_installed._path)
+    verifier = Verifier(repo_installed._path)
+    try:
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(verifier.verify_ref, ["refs/heads/main"] * 8))
+        assert all(r.valid for r in results)
+        assert results[0].commit == repo_installed.head.hash
+
+        assert [r.target for r in verifier.verify_refs()] == ["refs/heads/main"]
+    finally:
+        verifier.close()
+
+
+def test_verify_returns_violations(repo_installed: Repository):
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Add rules", cwd=repo_installed._path)
+    with uninstall_hooks(repo_installed):
+        cmd("git", "commit", "-m", "Invalid", "--allow-empty", cwd=repo_installed._path)
+
+    verifier = Verifier(repo_installed._path)
+    try:
+        result = verifier.verify_ref("refs/heads/main")
+        assert not result.valid
+        assert result.violation.sub_violations
+
+        bootstrap = verifier.project.bootstrap
+        result = verifier.verify_commit(repo_installed.head, bootstrap)
+        assert result.target == repo_installed.head.hash.hex()
+    finally:
+        verifier.close()
+
+
+def test_verify_invalid_bark_rules(repo_bark_rules_invalid: Repository):
+    verifier = Verifier(repo_bark_rules_invalid._path)
+    try:
+        (result,) = verifier.verify_refs()
+        assert result.target == "refs/heads/bark_rules"
+        assert not result.valid
+    finally:
+        verifier.close()
+
+
+def test_verify_ref_updates(repo_installed: Repository):
+    cmd("git", "commit", "-m", "First", "--allow-empty", cwd=repo_installed._path)
+    cmd("git", "branch", "other", cwd=repo_installed._path)
+    old = repo_installed.head.hash.hex()
+    with uninstall_hooks(repo_installed):
+        cmd("git", "commit", "-m", "Second", "--allow-empty", cwd=repo_installed._path)
+    new = repo_installed.head.hash.hex()
+
+    verifier = Verifier(repo_installed._path)
+    try:
+        results = verifier.verify_ref_updates(
+            [(old, new, "refs/heads/main"), (old, new, "refs/heads/other")]
+        )
+        assert [r.target for r in results] == ["refs/heads/main", "refs/heads/other"]
+        assert all(r.valid for r in results)
+        assert verifier.verify_ref_update(new, new, "refs/heads/main") is None
+    finally:
+        verifier.close()
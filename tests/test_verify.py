@@ -13,12 +13,30 @@
 # limitations under the License.
 
 from gitbark.util import cmd
-from gitbark.git import Repository
+from gitbark.git import Commit, Repository, limit_object_cache
+from gitbark.project import Project
+from gitbark import core
+from gitbark.commands import verify
+from gitbark.rule import (
+    RuleViolation,
+    CommitRule,
+    AllCommitRule,
+    AnyCommitRule,
+    fail_fast_rules,
+)
 
-from pytest_gitbark.util import verify_rules, write_commit_rules
+from pytest_gitbark.util import (
+    verify_rules,
+    write_bark_file,
+    write_commit_rules,
+    on_branch,
+    uninstall_hooks,
+)
 
+from pygit2 import settings
 from typing import Callable
 import pytest
+import os
 
 
 @pytest.mark.parametrize(
@@ -92,3 +110,351 @@ def test_commit_with_invalid_bark_rules(repo_bark_rules_invalid: Repository):
         "git", "commit", "-m", "Invalid", "--allow-empty", cwd=repo._path
     )
     verify_rules(repo=repo_bark_rules_invalid, passes=False, action=action)
+
+
+@pytest.mark.parametrize("passes", [True, False])
+def test_cherry_pick_sequence(repo_installed: Repository, passes):
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Skip: add commit rules", cwd=repo_installed._path)
+    main = repo_installed.head
+
+    path = repo_installed._path
+    with on_branch(repo_installed, "feature"):
+        for message in ["Skip 1", "Skip 2" if passes else "Invalid", "Skip 3"]:
+            cmd("git", "commit", "-m", message, "--allow-empty", cwd=path)
+
+    # Only the last step is verified, covering the commits picked before it
+    pick = ["git", "cherry-pick", "--allow-empty", "main..feature"]
+    if passes:
+        cmd(*pick, cwd=repo_installed._path)
+        assert repo_installed.head != main
+    else:
+        with pytest.raises(Exception):
+            cmd(*pick, cwd=repo_installed._path)
+        cmd("git", "cherry-pick", "--abort", cwd=repo_installed._path)
+        assert repo_installed.head == main
+
+
+def test_commit_during_cherry_pick(repo_installed: Repository):
+    path = repo_installed._path
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Skip: add commit rules", cwd=path)
+
+    with on_branch(repo_installed, "feature"):
+        cmd("git", "commit", "-m", "Invalid", "--allow-empty", cwd=path)
+        with open(os.path.join(path, "conflict.txt"), "w") as f:
+            f.write("feature")
+        cmd("git", "add", "conflict.txt", cwd=path)
+        cmd("git", "commit", "-m", "Skip 2", cwd=path)
+    with open(os.path.join(path, "conflict.txt"), "w") as f:
+        f.write("main")
+    cmd("git", "add", "conflict.txt", cwd=path)
+    cmd("git", "commit", "-m", "Skip: conflict", cwd=path)
+    main = repo_installed.head
+
+    # The pick of Invalid is deferred, then the pick of Skip 2 stops
+    with pytest.raises(Exception):
+        cmd("git", "cherry-pick", "--allow-empty", "main..feature", cwd=path)
+    assert repo_installed.head.parents[0] == main
+
+    # Committing the resolution verifies every commit picked so far
+    cmd("git", "add", "conflict.txt", cwd=path)
+    with pytest.raises(Exception):
+        cmd("git", "commit", "-m", "Skip 2", cwd=path)
+    cmd("git", "cherry-pick", "--abort", cwd=path)
+    assert repo_installed.head == main
+
+
+def test_skip_during_cherry_pick(repo_installed: Repository):
+    path = repo_installed._path
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Skip: add commit rules", cwd=path)
+
+    with on_branch(repo_installed, "feature"):
+        cmd("git", "commit", "-m", "Invalid", "--allow-empty", cwd=path)
+        with open(os.path.join(path, "conflict.txt"), "w") as f:
+            f.write("feature")
+        cmd("git", "add", "conflict.txt", cwd=path)
+        cmd("git", "commit", "-m", "Skip 2", cwd=path)
+    with open(os.path.join(path, "conflict.txt"), "w") as f:
+        f.write("main")
+    cmd("git", "add", "conflict.txt", cwd=path)
+    cmd("git", "commit", "-m", "Skip: conflict", cwd=path)
+    main = repo_installed.head
+
+    # The pick of Invalid is deferred, then the pick of Skip 2 stops
+    with pytest.raises(Exception):
+        cmd("git", "cherry-pick", "--allow-empty", "main..feature", cwd=path)
+    invalid = repo_installed.head
+
+    # Skipping the last pick ends the sequence, which verifies it
+    with pytest.raises(Exception):
+        cmd("git", "cherry-pick", "--skip", cwd=path)
+
+    # Quitting leaves the branch as is, the next transaction verifies it
+    cmd("git", "cherry-pick", "--quit", cwd=path)
+    assert repo_installed.head == invalid
+    with pytest.raises(Exception):
+        cmd("git", "branch", "other", cwd=path)
+    with pytest.raises(Exception):
+        cmd("git", "commit", "-m", "Skip 3", "--allow-empty", cwd=path)
+
+    # Until the branch no longer has the invalid commit
+    cmd("git", "reset", "--hard", main.hash.hex(), cwd=path)
+    cmd("git", "branch", "other", cwd=path)
+
+
+def test_plan_installs_of_valid_commits(repo_installed: Repository):
+    path = repo_installed._path
+    project = Project(path)
+    verify.verify_bark_rules(project)
+    bootstrap = project.bootstrap
+    assert bootstrap
+
+    with uninstall_hooks(repo_installed):
+        with on_branch(repo_installed, core.BARK_RULES_BRANCH):
+            trusted = repo_installed.head.read_file(core.BARK_REQUIREMENTS)
+            write_bark_file(
+                repo_installed, f"{path}/{core.BARK_REQUIREMENTS}", "untrusted\n"
+            )
+            cmd("git", "commit", "-m", "Untrusted requirements", cwd=path)
+            head = repo_installed.head
+
+    # Only the requirements of the valid parent are installed up front
+    cache = project.get_cache(bootstrap)
+    assert verify._plan_installs(cache, head, bootstrap) == [trusted]
+    project.update()
+
+
+def test_transaction_verifies_every_ref(repo_installed: Repository):
+    path = repo_installed._path
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Skip: add commit rules", cwd=path)
+    cmd("git", "branch", "other", cwd=path)
+    main = repo_installed.head
+
+    invalid, _ = cmd(
+        "git", "commit-tree", "HEAD^{tree}", "-p", "HEAD", "-m", "Invalid", cwd=path
+    )
+    # The update of main is rejected, although other comes last and is valid
+    updates = f"update refs/heads/main {invalid}\nupdate refs/heads/other {invalid}\n"
+    with pytest.raises(Exception):
+        cmd("git", "update-ref", "--stdin", cwd=path, input=updates)
+    assert repo_installed.head == main
+
+
+def test_heads_share_validation(repo_installed: Repository, monkeypatch):
+    path = repo_installed._path
+    with uninstall_hooks(repo_installed):
+        for i in range(3):
+            cmd("git", "commit", "-m", f"Commit {i}", "--allow-empty", cwd=path)
+    head = repo_installed.head
+    heads = [head, head.parents[0], head]
+
+    validated = []
+    validate_rules = core._validate_rules
+
+    def count_validations(commit, cache):
+        validated.append(commit)
+        validate_rules(commit, cache)
+
+    monkeypatch.setattr(core, "_validate_rules", count_validations)
+    project = Project(path)
+    (rule,) = core.get_bark_rules(project).get_ref_rules("refs/heads/main")
+    bootstrap = Commit(rule.bootstrap, repo_installed)
+    cache = project.get_cache(bootstrap)
+    results = core.validate_heads_commit_rules(cache, heads, bootstrap)
+    project.update()
+
+    assert results == {head: None, head.parents[0]: None}
+    assert len(validated) == len(set(validated)) == 3
+
+
+def test_walk_stops_at_checkpoints(repo_installed: Repository, bark_cli, monkeypatch):
+    path = repo_installed._path
+    for i in range(3):
+        cmd("git", "commit", "-m", f"Commit {i}", "--allow-empty", cwd=path)
+    project = Project(path)
+    (rule,) = core.get_bark_rules(project).get_ref_rules("refs/heads/main")
+    bootstrap = Commit(rule.bootstrap, repo_installed)
+    assert project.get_checkpoints(bootstrap) == [repo_installed.head]
+
+    with uninstall_hooks(repo_installed):
+        cmd("git", "commit", "-m", "New", "--allow-empty", cwd=path)
+    head = repo_installed.head
+
+    cache = project.get_cache(bootstrap)
+    looked_up = []
+    has = cache.has
+    monkeypatch.setattr(cache, "has", lambda c: looked_up.append(c) or has(c))
+    results = core.validate_heads_commit_rules(
+        cache, [head], bootstrap, project.get_checkpoints(bootstrap)
+    )
+    project.update()
+
+    assert results == {head: None}
+    # Only the new commit and its parent, the checkpoint, are looked up
+    assert set(looked_up) <= {head, head.parents[0]}
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_reset_to_invalid_ancestor(repo_installed: Repository, stream):
+    path = repo_installed._path
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Skip: add commit rules", cwd=path)
+    with uninstall_hooks(repo_installed):
+        cmd("git", "commit", "-m", "Invalid", "--allow-empty", cwd=path)
+        invalid = repo_installed.head
+        cmd("git", "commit", "-m", "Skip", "--allow-empty", cwd=path)
+    head = repo_installed.head
+    project = Project(path)
+    verify.verify_all(project, stream=stream)
+    project.update()
+
+    # The invalid commit is an ancestor of the checkpoint, but is re-validated
+    with pytest.raises(Exception):
+        cmd("git", "reset", "--hard", invalid.hash.hex(), cwd=path)
+    assert repo_installed.head == head
+
+    with uninstall_hooks(repo_installed):
+        cmd("git", "reset", "--hard", invalid.hash.hex(), cwd=path)
+    project = Project(path)
+    with pytest.raises(RuleViolation):
+        verify.verify_all(project, stream=stream)
+    project.update()
+
+
+def test_verify_changed_refs(repo_installed: Repository, monkeypatch):
+    path = repo_installed._path
+    cmd("git", "branch", "other", cwd=path)
+    project = Project(path)
+    verify.verify_all(project)
+
+    verified = []
+    do_verify_ref = verify._do_verify_ref
+
+    def record_ref(project, ref, head, rules, validated=None):
+        if rules:
+            verified.append(ref)
+        do_verify_ref(project, ref, head, rules, validated)
+
+    monkeypatch.setattr(verify, "_do_verify_ref", record_ref)
+    verify.verify_all(project, changed=True)
+    assert verified == []
+
+    with uninstall_hooks(repo_installed):
+        cmd("git", "commit", "-m", "New", "--allow-empty", cwd=path)
+    verify.verify_all(project, changed=True)
+    assert verified == ["refs/heads/main"]
+
+    # Ref rules are loaded from the head of bark_rules, and may read its files
+    verified.clear()
+    with on_branch(repo_installed, core.BARK_RULES_BRANCH):
+        cmd("git", "commit", "-m", "Rules", "--allow-empty", cwd=path)
+    verify.verify_all(project, changed=True)
+    project.update()
+    assert verified == ["refs/heads/main"]
+
+
+def test_stream_heads(repo_installed: Repository, monkeypatch):
+    path = repo_installed._path
+    with uninstall_hooks(repo_installed):
+        for i in range(3):
+            cmd("git", "commit", "-m", f"Commit {i}", "--allow-empty", cwd=path)
+        valid = repo_installed.head
+        write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+        cmd("git", "commit", "-m", "Skip: add commit rules", cwd=path)
+        cmd("git", "commit", "-m", "Invalid", "--allow-empty", cwd=path)
+    invalid = repo_installed.head
+
+    project = Project(path)
+    (rule,) = core.get_bark_rules(project).get_ref_rules("refs/heads/main")
+    bootstrap = Commit(rule.bootstrap, repo_installed)
+    cache = project.get_cache(bootstrap)
+    flushes = []
+    monkeypatch.setattr(cache, "flush", lambda: flushes.append(True))
+    results = core.stream_heads_commit_rules(
+        cache, [valid, invalid], bootstrap, chunk_size=2
+    )
+
+    assert results[valid] is None
+    assert results[invalid] is not None
+    assert cache.get(valid) is True
+    assert cache.get(invalid) is False
+    # Results are written as they are produced
+    assert len(flushes) >= 3
+    project.update()
+
+
+def test_object_cache_limit_is_restored():
+    _, previous = settings.cached_memory
+    with limit_object_cache(1024 * 1024):
+        assert settings.cached_memory[1] == 1024 * 1024
+    assert settings.cached_memory[1] == previous
+
+
+def test_fail_fast_stops_at_first_invalid_ref(repo_installed: Repository, monkeypatch):
+    path = repo_installed._path
+    cmd("git", "branch", "other", cwd=path)
+    write_commit_rules(repo_installed, {"rules": [{"always_fail": None}]})
+    cmd("git", "commit", "-m", "Skip: add commit rules", cwd=path)
+    with uninstall_hooks(repo_installed):
+        cmd("git", "commit", "-m", "Invalid", "--allow-empty", cwd=path)
+
+    verified = []
+    do_verify_ref = verify._do_verify_ref
+
+    def record_ref(project, ref, head, rules, validated=None):
+        verified.append(ref)
+        do_verify_ref(project, ref, head, rules, validated)
+
+    monkeypatch.setattr(verify, "_do_verify_ref", record_ref)
+    project = Project(path)
+    with pytest.raises(RuleViolation) as e:
+        verify.verify_all(project, fail_fast=True)
+    project.update()
+
+    assert len(e.value.sub_violations) == 1
+    # The changed ref with rules is verified first, refs without rules are skipped
+    assert verified == ["refs/heads/main"]
+
+
+def test_fail_fast_composite_rules(repo_installed: Repository):
+    validated = []
+
+    class Rule(CommitRule):
+        def _parse_args(self, args):
+            self.valid = args
+
+        def validate(self, commit):
+            validated.append(self.name)
+            if not self.valid:
+                raise RuleViolation(f"{self.name} failed")
+
+    head = repo_installed.head
+    project = Project(repo_installed._path)
+    cache = project.get_cache(head)
+    rules = [Rule("a", head, cache, False), Rule("b", head, cache, False)]
+
+    with pytest.raises(RuleViolation):
+        AllCommitRule("all", head, cache, rules).validate(head)
+    assert validated == ["a", "b"]
+
+    validated.clear()
+    with fail_fast_rules():
+        with pytest.raises(RuleViolation):
+            AllCommitRule("all", head, cache, rules).validate(head)
+        assert validated == ["a"]
+        # The rule which failed is tried first
+        validated.clear()
+        rules.reverse()
+        with pytest.raises(RuleViolation):
+            AllCommitRule("all", head, cache, rules).validate(head)
+        assert validated == ["a"]
+
+    # Any rules stop at the first passing child
+    validated.clear()
+    rules = [Rule("c", head, cache, True), Rule("d", head, cache, True)]
+    AnyCommitRule("any", head, cache, rules).validate(head)
+    assert validated == ["c"]
+    project.update()